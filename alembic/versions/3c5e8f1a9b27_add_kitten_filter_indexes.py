@@ -0,0 +1,34 @@
+"""Add kitten filter and sort indexes
+
+Revision ID: 3c5e8f1a9b27
+Revises: 74e96238edf1
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c5e8f1a9b27'
+down_revision: Union[str, None] = '74e96238edf1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_kittens_breed_id_id', 'kittens', ['breed_id', 'id'], unique=False)
+    op.create_index('ix_kittens_breed_id_age_id', 'kittens', ['breed_id', 'age', 'id'], unique=False)
+    op.create_index('ix_kittens_age_id', 'kittens', ['age', 'id'], unique=False)
+    op.create_index('ix_kittens_color_id', 'kittens', ['color', 'id'], unique=False)
+    op.create_index('ix_kittens_color_age_id', 'kittens', ['color', 'age', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_kittens_color_age_id', table_name='kittens')
+    op.drop_index('ix_kittens_color_id', table_name='kittens')
+    op.drop_index('ix_kittens_age_id', table_name='kittens')
+    op.drop_index('ix_kittens_breed_id_age_id', table_name='kittens')
+    op.drop_index('ix_kittens_breed_id_id', table_name='kittens')
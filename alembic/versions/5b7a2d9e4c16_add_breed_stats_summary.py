@@ -0,0 +1,59 @@
+"""Add incrementally maintained breed statistics
+
+Revision ID: 5b7a2d9e4c16
+Revises: 9d41b6c2e7a3
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.models import BREED_STATS_POSTGRES_DDL
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7a2d9e4c16'
+down_revision: Union[str, None] = '9d41b6c2e7a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'breed_age_stats',
+        sa.Column('breed_id', sa.Integer(), nullable=False),
+        sa.Column('age', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['breed_id'], ['breeds.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('breed_id', 'age')
+    )
+    op.create_table(
+        'breed_color_stats',
+        sa.Column('breed_id', sa.Integer(), nullable=False),
+        sa.Column('color', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['breed_id'], ['breeds.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('breed_id', 'color')
+    )
+    # Сводка заполняется по существующим котятам до того, как триггеры начнут её обновлять
+    op.execute("LOCK TABLE kittens IN SHARE MODE")
+    op.execute(
+        "INSERT INTO breed_age_stats (breed_id, age, count) "
+        "SELECT breed_id, age, count(*) FROM kittens GROUP BY breed_id, age"
+    )
+    op.execute(
+        "INSERT INTO breed_color_stats (breed_id, color, count) "
+        "SELECT breed_id, color, count(*) FROM kittens GROUP BY breed_id, color"
+    )
+    for statement in BREED_STATS_POSTGRES_DDL:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS kittens_breed_stats_ad ON kittens")
+    op.execute("DROP TRIGGER IF EXISTS kittens_breed_stats_au ON kittens")
+    op.execute("DROP TRIGGER IF EXISTS kittens_breed_stats_ai ON kittens")
+    op.execute("DROP FUNCTION IF EXISTS kittens_breed_stats()")
+    op.drop_table('breed_color_stats')
+    op.drop_table('breed_age_stats')
@@ -0,0 +1,32 @@
+"""Add full-text search over kitten descriptions
+
+Revision ID: 9d41b6c2e7a3
+Revises: 3c5e8f1a9b27
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.models import SEARCH_CONFIG
+
+# revision identifiers, used by Alembic.
+revision: str = '9d41b6c2e7a3'
+down_revision: Union[str, None] = '3c5e8f1a9b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        f"ALTER TABLE kittens ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(description, ''))) STORED"
+    )
+    op.create_index('ix_kittens_search_vector', 'kittens', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_kittens_search_vector', table_name='kittens')
+    op.drop_column('kittens', 'search_vector')
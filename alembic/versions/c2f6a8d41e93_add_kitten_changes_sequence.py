@@ -0,0 +1,25 @@
+"""Add sequence for kitten change feed event ids
+
+Revision ID: c2f6a8d41e93
+Revises: 5b7a2d9e4c16
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f6a8d41e93'
+down_revision: Union[str, None] = '5b7a2d9e4c16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('kitten_changes_id_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('kitten_changes_id_seq')))
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from benchmarks.runner import State, compare, run_all
+from benchmarks.seed import seed
+from src.application import app
+from src.database import Database
+from src.factory import service_factory
+from src.models import Breed, Kitten
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///" + os.path.join(tempfile.gettempdir(), "kittens-benchmark.db")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Нагрузочный прогон всех эндпоинтов")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL,
+                        help="База для прогона; при засеве её схема пересоздаётся")
+    parser.add_argument("--kittens", type=int, default=1000, help="Сколько котят засеять")
+    parser.add_argument("--breeds", type=int, default=50, help="Сколько пород засеять")
+    parser.add_argument("--skip-seed", action="store_true", help="Использовать уже засеянную базу")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=20, help="Одновременных запросов")
+    parser.add_argument("--write-concurrency", type=int,
+                        help="Одновременных запросов на запись; для SQLite по умолчанию 1")
+    parser.add_argument("--only", help="Гонять только эндпоинты, в имени которых есть эта подстрока")
+    parser.add_argument("--output", default="benchmark-results.json", help="Куда записать результаты")
+    parser.add_argument("--baseline", help="JSON с эталонными результатами для сравнения")
+    parser.add_argument("--save-baseline", action="store_true", help="Записать результаты как новый эталон")
+    parser.add_argument("--latency-tolerance", type=float, default=1.0, help="Допустимый рост p95, доля")
+    parser.add_argument("--throughput-tolerance", type=float, default=0.5, help="Допустимое падение rps, доля")
+    parser.add_argument("--query-tolerance", type=float, default=0.5, help="Допустимый рост числа запросов к базе")
+    return parser
+
+
+async def run(args: argparse.Namespace) -> dict:
+    db = Database(args.database_url, echo=False)
+    engine = db.engine
+    seed_seconds = None
+    if not args.skip_seed:
+        seed_seconds = await seed(engine, args.kittens, args.breeds)
+
+    async with engine.connect() as conn:
+        breed_ids = list((await conn.execute(select(Breed.id))).scalars())
+        kitten_ids = list((await conn.execute(select(Kitten.id))).scalars())
+
+    # SQLite пропускает одного писателя за раз: параллельные записи меряли бы только ожидание блокировки
+    write_concurrency = args.write_concurrency or (1 if engine.dialect.name == "sqlite" else args.concurrency)
+    # Все пути приложения, включая фоновую запись пачек, идут в базу прогона
+    service_factory.use_database(db)
+    state = State(breed_ids=breed_ids, kitten_ids=kitten_ids, rng=random.Random(0))
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+            endpoints = await run_all(
+                client, state, args.requests, args.concurrency, write_concurrency, only=args.only
+            )
+    finally:
+        service_factory.use_database(None)
+        await db.dispose()
+
+    return {
+        "meta": {
+            "database": engine.dialect.name,
+            "kittens": args.kittens,
+            "breeds": args.breeds,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "write_concurrency": write_concurrency,
+            "seed_seconds": round(seed_seconds, 3) if seed_seconds is not None else None,
+            "python": platform.python_version(),
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    for name, stats in results["endpoints"].items():
+        latency = stats["latency_ms"]
+        print(
+            f"{name:32} {stats['throughput_rps']:>9} rps  p50 {latency['p50']:>8}ms  "
+            f"p95 {latency['p95']:>8}ms  p99 {latency['p99']:>8}ms  "
+            f"queries {stats['queries_per_request']:>6}  errors {stats['errors']}"
+        )
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        return 0
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(
+            results, baseline, args.latency_tolerance, args.throughput_tolerance, args.query_tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
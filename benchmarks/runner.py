@@ -0,0 +1,227 @@
+import asyncio
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from httpx import AsyncClient, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.seed import COLORS, WORDS
+
+# Все запросы к базе за время сценария: вместе с общими чтениями single-flight и фоновой записью пачек.
+# Среднее на HTTP-запрос не зависит от того, в чьём контексте выполнился общий запрос
+_queries = [0]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    _queries[0] += 1
+
+
+@dataclass
+class State:
+    breed_ids: List[int]
+    kitten_ids: List[int]
+    rng: random.Random
+    created: List[int] = field(default_factory=list)
+    created_bulk: List[int] = field(default_factory=list)
+
+    def kitten_id(self) -> int:
+        return self.rng.choice(self.kitten_ids)
+
+    def kitten_body(self) -> Dict[str, Any]:
+        return {
+            "color": self.rng.choice(COLORS),
+            "age": self.rng.randint(0, 20),
+            "description": " ".join(self.rng.sample(WORDS, 4)),
+            "breedId": self.rng.choice(self.breed_ids),
+        }
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    build: Callable[[State], Dict[str, Any]]
+    on_response: Optional[Callable[[State, Response], None]] = None
+    # Тяжёлые сценарии вроде выгрузки гоняются меньшим числом запросов
+    share: float = 1.0
+    # Подготовка данных сценария до замера: получает клиент, состояние и число запросов
+    prepare: Optional[Callable[[AsyncClient, State, int], Awaitable[None]]] = None
+
+
+def _path(template: str, **values: Any) -> Dict[str, Any]:
+    return {"url": template.format(**values)}
+
+
+def _created(count_per_request: int, target: str) -> Callable[[AsyncClient, State, int], Awaitable[None]]:
+    # Досоздаём котят, которых сценарий удалит, если предыдущие сценарии их не создали (например, с --only)
+    async def prepare(client: AsyncClient, state: State, requests: int) -> None:
+        ids = getattr(state, target)
+        while len(ids) < requests * count_per_request:
+            count = min(1000, requests * count_per_request - len(ids))
+            response = await client.post("/kittens/bulk", json=[state.kitten_body() for _ in range(count)])
+            response.raise_for_status()
+            ids.extend(item["kitten"]["id"] for item in response.json())
+
+    return prepare
+
+
+# Удаления расходуют котят, созданных предыдущими сценариями, и досоздают недостающих
+SCENARIOS = [
+    Scenario("GET /breeds/", "GET", lambda s: _path("/breeds/")),
+    Scenario("GET /breeds/stats", "GET", lambda s: _path("/breeds/stats")),
+    Scenario("GET /kittens/", "GET", lambda s: {"url": "/kittens/", "params": {"limit": 100}}),
+    Scenario(
+        "GET /kittens/?fields", "GET",
+        lambda s: {"url": "/kittens/", "params": {"limit": 100, "fields": "id,color,age"}},
+    ),
+    Scenario(
+        "GET /kittens/?breed_id&sort", "GET",
+        lambda s: {"url": "/kittens/", "params": {"breed_id": s.rng.choice(s.breed_ids), "sort": "-age"}},
+    ),
+    Scenario(
+        "GET /kittens/search", "GET",
+        lambda s: {"url": "/kittens/search", "params": {"q": s.rng.choice(WORDS), "limit": 20}},
+    ),
+    Scenario(
+        "GET /kittens/export", "GET",
+        lambda s: {"url": "/kittens/export", "params": {"breed_id": s.rng.choice(s.breed_ids)}},
+        share=0.1,
+    ),
+    Scenario("GET /kittens/cache/stats", "GET", lambda s: _path("/kittens/cache/stats")),
+    Scenario("GET /kittens/coalescing/stats", "GET", lambda s: _path("/kittens/coalescing/stats")),
+    Scenario("GET /kittens/batching/stats", "GET", lambda s: _path("/kittens/batching/stats")),
+    Scenario("GET /kittens/changes/stats", "GET", lambda s: _path("/kittens/changes/stats")),
+    Scenario("GET /kittens/{kitten_id}", "GET", lambda s: _path("/kittens/{id}", id=s.kitten_id())),
+    Scenario(
+        "POST /kittens/", "POST",
+        lambda s: {"url": "/kittens/", "json": s.kitten_body()},
+        on_response=lambda s, r: s.created.append(r.json()["id"]),
+    ),
+    Scenario(
+        "POST /kittens/bulk", "POST",
+        lambda s: {"url": "/kittens/bulk", "json": [s.kitten_body() for _ in range(10)]},
+        on_response=lambda s, r: s.created_bulk.extend(item["kitten"]["id"] for item in r.json()),
+    ),
+    Scenario(
+        "PUT /kittens/{kitten_id}", "PUT",
+        lambda s: {**_path("/kittens/{id}", id=s.kitten_id()), "json": s.kitten_body()},
+    ),
+    Scenario(
+        "PATCH /kittens/bulk", "PATCH",
+        lambda s: {"url": "/kittens/bulk", "json": [
+            {"id": s.kitten_id(), "age": s.rng.randint(0, 20)} for _ in range(10)
+        ]},
+    ),
+    Scenario(
+        "PATCH /kittens/{kitten_id}", "PATCH",
+        lambda s: {**_path("/kittens/{id}", id=s.kitten_id()), "json": {"color": s.rng.choice(COLORS)}},
+    ),
+    Scenario(
+        "DELETE /kittens/", "DELETE",
+        lambda s: {"url": "/kittens/", "params": {"ids": [s.created_bulk.pop() for _ in range(10)]}},
+        prepare=_created(10, "created_bulk"),
+    ),
+    Scenario(
+        "DELETE /kittens/{kitten_id}", "DELETE", lambda s: _path("/kittens/{id}", id=s.created.pop()),
+        prepare=_created(1, "created"),
+    ),
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def run_scenario(
+    client: AsyncClient, scenario: Scenario, state: State, requests: int, concurrency: int
+) -> Dict[str, Any]:
+    total = max(1, int(requests * scenario.share))
+    if scenario.prepare is not None:
+        await scenario.prepare(client, state, total)
+    latencies: List[float] = []
+    errors = 0
+    issued = 0
+
+    async def worker() -> None:
+        nonlocal errors, issued
+        while issued < total:
+            issued += 1
+            request = scenario.build(state)
+            started = time.perf_counter()
+            response = await client.request(scenario.method, **request)
+            latencies.append(time.perf_counter() - started)
+            if response.is_success:
+                if scenario.on_response is not None:
+                    scenario.on_response(state, response)
+            else:
+                errors += 1
+
+    queries = _queries[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    elapsed = time.perf_counter() - started
+    queries = _queries[0] - queries
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "latency_ms": {
+            name: round(percentile(latencies, p) * 1000, 3)
+            for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "queries_per_request": round(queries / total, 3),
+    }
+
+
+async def run_all(
+    client: AsyncClient,
+    state: State,
+    requests: int,
+    concurrency: int,
+    write_concurrency: int,
+    only: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for scenario in SCENARIOS:
+        if only and only not in scenario.name:
+            continue
+        workers = concurrency if scenario.method == "GET" else write_concurrency
+        results[scenario.name] = await run_scenario(client, scenario, state, requests, workers)
+    return results
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    latency_tolerance: float = 1.0,
+    throughput_tolerance: float = 0.5,
+    query_tolerance: float = 0.5,
+) -> List[str]:
+    # Число запросов к базе не зависит от машины: допуск меньше одного запроса ловит лишний
+    # запрос на пути записи и гасит разброс в чтениях, объединённых single-flight и кэшем
+    regressions = []
+    for key in ("database", "kittens", "breeds"):
+        if results["meta"][key] != baseline["meta"][key]:
+            return [f"baseline was recorded with {key}={baseline['meta'][key]!r}, run has {results['meta'][key]!r}"]
+    for name, expected in baseline["endpoints"].items():
+        actual = results["endpoints"].get(name)
+        if actual is None:
+            continue
+        if actual["errors"]:
+            regressions.append(f"{name}: {actual['errors']} failed requests")
+        limit = expected["latency_ms"]["p95"] * (1 + latency_tolerance)
+        if actual["latency_ms"]["p95"] > limit:
+            regressions.append(f"{name}: p95 {actual['latency_ms']['p95']}ms > {limit:.3f}ms")
+        floor = expected["throughput_rps"] * (1 - throughput_tolerance)
+        if actual["throughput_rps"] < floor:
+            regressions.append(f"{name}: throughput {actual['throughput_rps']} rps < {floor:.2f} rps")
+        ceiling = expected["queries_per_request"] + query_tolerance
+        if actual["queries_per_request"] > ceiling:
+            regressions.append(f"{name}: {actual['queries_per_request']} queries per request > {ceiling}")
+    return regressions
@@ -0,0 +1,44 @@
+import random
+import time
+from typing import List
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.models import Base, Breed, Kitten
+
+COLORS = ("black", "white", "red", "grey", "cream", "tabby", "calico", "tortoiseshell")
+WORDS = (
+    "fluffy", "playful", "calm", "quiet", "curious", "sleepy", "active", "friendly", "shy", "loud",
+    "gentle", "clever", "lazy", "hungry", "tiny", "brave", "soft", "striped", "spotted", "cuddly",
+)
+SEED_CHUNK_SIZE = 5000
+
+
+def kitten_rows(count: int, breed_ids: List[int], rng: random.Random):
+    for _ in range(count):
+        yield {
+            "color": rng.choice(COLORS),
+            "age": rng.randint(0, 20),
+            "description": " ".join(rng.sample(WORDS, 4)),
+            "breed_id": rng.choice(breed_ids),
+        }
+
+
+async def seed(engine: AsyncEngine, kittens: int, breeds: int, seed_value: int = 0) -> float:
+    # Схема пересоздаётся целиком: триггеры и индексы те же, что у приложения
+    started = time.perf_counter()
+    rng = random.Random(seed_value)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Breed), [{"name": f"breed-{index}"} for index in range(breeds)])
+        breed_ids = list((await conn.execute(select(Breed.id).order_by(Breed.id))).scalars())
+    rows = kitten_rows(kittens, breed_ids, rng)
+    remaining = kittens
+    while remaining:
+        chunk = [next(rows) for _ in range(min(SEED_CHUNK_SIZE, remaining))]
+        async with engine.begin() as conn:
+            await conn.execute(insert(Kitten), chunk)
+        remaining -= len(chunk)
+    return time.perf_counter() - started
@@ -1,10 +1,7 @@
-import uvicorn
+import sys
+
+from src.serve import main
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "src.application:app",
-        host="0.0.0.0",
-        port=8001,
-        log_config="logging.ini",
-        reload=True,
-    )
+    # Для разработки: python main.py --profile dev
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Tuple
+
+from starlette.responses import JSONResponse
+
+from src.metrics import Gauge, Labels, measure_pool_wait, registry
+from src.settings import AdmissionLimit, AdmissionSettings
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class AdaptiveLimiter:
+    # Лимит одновременных запросов по AIMD: медленно растёт, пока пул отдаёт соединения без ожидания,
+    # и умножается на decrease_factor, когда запросы начинают ждать соединение дольше целевого
+    def __init__(self, settings: AdmissionLimit, pool_wait_target: float, decrease_factor: float):
+        self.settings = settings
+        self.pool_wait_target = pool_wait_target
+        self.decrease_factor = decrease_factor
+        self.limit = float(settings.initial)
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _queue_bound(self) -> int:
+        # Очередь не длиннее текущего лимита: при снижении лимита сокращается и она
+        return min(self.settings.queue_size, int(self.limit))
+
+    async def acquire(self) -> bool:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self._queue_bound():
+            self.rejected += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            # Ждём саму future, а не wait_for: отмена или таймаут, пришедшие после передачи места,
+            # доходят до обработчиков ниже, и место не теряется
+            async with asyncio.timeout(self.settings.queue_timeout):
+                await future
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Место выдали одновременно с истечением ожидания: запрос допущен
+                return True
+            if future in self._waiters:
+                self._waiters.remove(future)
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже передано этому запросу — возвращаем его
+                self._give_back()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            raise
+        return True
+
+    def release(self, admitted_at: float, pool_wait: float) -> None:
+        saturated = self.in_flight >= int(self.limit) or bool(self._waiters)
+        self.in_flight -= 1
+        if pool_wait > self.pool_wait_target:
+            # Снижаем лимит по запросам, допущенным уже после прошлого снижения,
+            # иначе одна волна медленных запросов обвалит его до минимума
+            if admitted_at >= self._last_decrease:
+                self.limit = max(self.settings.min, self.limit * self.decrease_factor)
+                self._last_decrease = time.monotonic()
+        elif saturated:
+            # +1 за «окно» из limit успешных запросов
+            self.limit = min(self.settings.max, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _give_back(self) -> None:
+        # Место не было использовано: это не успешный запрос, лимит от него не растёт
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def _admission_stats() -> Iterable[Tuple[Labels, float]]:
+    for name, limiter in list(_limiters.items()):
+        yield (name, "limit"), int(limiter.limit)
+        yield (name, "in_flight"), limiter.in_flight
+        yield (name, "queued"), limiter.queued
+        yield (name, "rejected"), limiter.rejected
+
+
+HTTP_ADMISSION = registry.register(Gauge(
+    "http_admission", "Admission control: concurrency limit, in flight, queued and rejected requests",
+    ("class", "state"), _admission_stats,
+))
+
+
+class AdmissionMiddleware:
+    # Ограничивает одновременные запросы отдельно для чтения и записи; сверх лимита запрос ждёт
+    # в короткой очереди, а при переполнении или истечении ожидания сразу получает 503 с Retry-After
+    def __init__(self, app, settings: AdmissionSettings):
+        self.app = app
+        self.settings = settings
+        self.limiters = {
+            name: AdaptiveLimiter(limit, settings.pool_wait_target_ms / 1000, settings.decrease_factor)
+            for name, limit in (("read", settings.read), ("write", settings.write))
+        }
+        _limiters.update(self.limiters)
+
+    def _exempt(self, path: str) -> bool:
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.settings.exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.enabled or self._exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        route_class = "read" if scope["method"] in READ_METHODS else "write"
+        limiter = self.limiters[route_class]
+        if not await limiter.acquire():
+            logger.warning("Shedding %s %s: %s limit %d reached", scope["method"], scope["path"], route_class, int(limiter.limit))
+            response = JSONResponse(
+                {"detail": "Service is overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.settings.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        admitted_at = time.monotonic()
+        with measure_pool_wait() as waited:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                limiter.release(admitted_at, waited[0])
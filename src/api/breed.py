@@ -1,15 +1,28 @@
 from typing import List
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Header, Response
 
+from src.encoding import Codec, response_codec
 from src.factory import ServiceFactory, service_factory
-from src.schemas.breed import BreedView
+from src.schemas.breed import BreedStats, BreedView
 from src.services.breed import BreedService
 
 router = APIRouter(tags=['breeds'], prefix='/breeds')
 
 
 @router.get("/", response_model=List[BreedView], description="Получение списка пород")
-async def list_breeds(service: BreedService = Depends(service_factory.create_breed_service)):
-    return await service.list_breeds()
+async def list_breeds(
+    if_none_match: str | None = Header(None),
+    codec: Codec = Depends(response_codec),
+    service: BreedService = Depends(service_factory.create_breed_service)
+):
+    catalogue = await service.get_breeds_catalogue(codec)
+    headers = {"ETag": catalogue.etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if catalogue.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=catalogue.body, media_type=codec.media_type, headers=headers)
 
+
+@router.get("/stats", response_model=List[BreedStats], description="Статистика по породам: число котят, возраст и цвета")
+async def breed_stats(service: BreedService = Depends(service_factory.create_breed_service)):
+    return await service.get_breed_stats()
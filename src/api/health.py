@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from starlette.responses import JSONResponse
+
+from src.lifecycle import lifecycle
+
+router = APIRouter(tags=['health'], prefix='/health')
+
+
+@router.get("/live", description="Процесс жив")
+async def live():
+    return {"status": "ok"}
+
+
+@router.get("/ready", description="Приложение прогрето и принимает запросы")
+async def ready():
+    if not lifecycle.ready:
+        status = "draining" if lifecycle.draining else "starting"
+        return JSONResponse(status_code=503, content={"status": status})
+    return {"status": "ok"}
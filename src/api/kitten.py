@@ -1,54 +1,197 @@
-from typing import Optional, List
+from typing import Dict, Optional, List
 
-from fastapi import Depends, APIRouter, Query, HTTPException
+from pydantic import Field, ValidationError
+from typing_extensions import Annotated
 
+from fastapi import Depends, APIRouter, Header, Query, HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from src.changes import ChangeFeed, event_stream
+from src.encoding import JSON, Codec, response_codec
 from src.factory import ServiceFactory, service_factory
-from src.schemas.kitten import KittenView, KittenCreate, KittenUpdate, KittenPatch
+from src.schemas.kitten import (
+    KittenView, KittenCreate, KittenUpdate, KittenPatch, KittenBulkResult, KittenBulkPatch, KittenBulkOutcome,
+    KittenFilter,
+)
 from src.services.kitten import KittenService
+from src.settings import Settings, get_settings
 
 router = APIRouter(tags=['kittens'], prefix='/kittens')
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+BULK_MAX_ITEMS = 10000
+FIELDS_DESCRIPTION = "Список возвращаемых полей через запятую, например id,color,breed.name"
+
+
+def encoded_response(body: bytes, codec: Codec, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=body, media_type=codec.media_type, headers={"Vary": "Accept", **(headers or {})})
+
+
+def negotiated_view(view: KittenView, codec: Codec):
+    # JSON отдаёт сам FastAPI по response_model, остальные форматы кодируем здесь
+    if codec is JSON:
+        return view
+    return encoded_response(codec.dump_model(view), codec)
+
+
+def kitten_filters(
+    breed_id: Optional[List[int]] = Query(None, description="ID пород для фильтрации"),
+    age_min: Optional[int] = Query(None, description="Минимальный возраст"),
+    age_max: Optional[int] = Query(None, description="Максимальный возраст"),
+    color: Optional[List[str]] = Query(None, description="Окрасы для фильтрации"),
+    sort: str = Query("id", description="Сортировка через запятую, например age,-id"),
+) -> KittenFilter:
+    try:
+        return KittenFilter(
+            breed_ids=breed_id or (), age_min=age_min, age_max=age_max, colors=color or (), sort=sort
+        )
+    except ValidationError as exc:
+        raise HTTPException(status_code=400, detail=exc.errors(include_url=False, include_context=False))
+
 
 @router.get("/", response_model=List[KittenView], description="Получение списка всех котят с фильтром")
 async def list_kittens(
+    response: Response,
+    filters: KittenFilter = Depends(kitten_filters),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    codec: Codec = Depends(response_codec),
+    service: KittenService = Depends(service_factory.create_kitten_service)
+):
+    if fields is not None or codec is not JSON or get_settings(Settings).fast_read_path:
+        body, next_cursor = await service.list_kittens_body(
+            filters, limit=limit, cursor=cursor, fields=fields, codec=codec
+        )
+        return encoded_response(body, codec, {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
+    page = await service.list_kittens(filters, limit=limit, cursor=cursor)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+
+@router.get("/search", response_model=List[KittenView], description="Полнотекстовый поиск котят по описанию")
+async def search_kittens(
+    q: str = Query(..., min_length=1, max_length=256, description="Поисковый запрос"),
+    breed_id: Optional[int] = Query(None, description="ID породы для фильтрации"),
+    limit: int = Query(20, ge=1, le=100, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из заголовка X-Next-Cursor"),
+    codec: Codec = Depends(response_codec),
+    service: KittenService = Depends(service_factory.create_kitten_service)
+):
+    body, next_cursor = await service.search_kittens_body(q, breed_id, limit=limit, cursor=cursor, codec=codec)
+    return encoded_response(body, codec, {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
+
+
+@router.get("/export", response_class=StreamingResponse, description="Потоковая выгрузка котят в формате NDJSON")
+async def export_kittens(
     breed_id: Optional[int] = Query(None, description="ID породы для фильтрации"),
     service: KittenService = Depends(service_factory.create_kitten_service)
 ):
-    return await service.list_kittens(breed_id)
+    filters = KittenFilter(breed_ids=(breed_id,) if breed_id else ())
+    return StreamingResponse(service.export_kittens(filters), media_type="application/x-ndjson")
+
+
+@router.get("/cache/stats", response_model=Dict[str, int], description="Счётчики попаданий в кэш котят")
+async def kitten_cache_stats(service: KittenService = Depends(service_factory.create_kitten_service)):
+    return service.cache_stats()
+
+
+@router.get("/coalescing/stats", response_model=Dict[str, int], description="Счётчики объединённых одинаковых запросов")
+async def coalescing_stats(service: KittenService = Depends(service_factory.create_kitten_service)):
+    return service.coalescing_stats()
+
+
+@router.get("/batching/stats", response_model=Dict[str, int], description="Счётчики пачек, в которые склеены одиночные добавления")
+async def batching_stats(service: KittenService = Depends(service_factory.create_kitten_service)):
+    return service.batching_stats()
+
+
+@router.get("/changes", response_class=StreamingResponse, description="Поток изменений котят (Server-Sent Events), продолжение по Last-Event-ID")
+async def kitten_changes(
+    last_event_id: Optional[str] = Header(None),
+    feed: ChangeFeed = Depends(service_factory.get_change_feed),
+):
+    try:
+        resume_from = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    settings = get_settings(Settings).changes
+    return StreamingResponse(
+        event_stream(feed, resume_from, settings.keepalive, settings.retry_ms),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/changes/stats", response_model=Dict[str, int], description="Подписчики и счётчики ленты изменений")
+async def kitten_changes_stats(feed: ChangeFeed = Depends(service_factory.get_change_feed)):
+    return feed.snapshot()
 
 
 @router.get("/{kitten_id}", response_model=KittenView, description="Получение информации о котёнке")
 async def get_kitten(
         kitten_id: int,
+        fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+        codec: Codec = Depends(response_codec),
         service: KittenService = Depends(service_factory.create_kitten_service)
 ):
+    if fields is not None or codec is not JSON or get_settings(Settings).fast_read_path:
+        return encoded_response(await service.get_kitten_body(kitten_id, fields, codec), codec)
     return await service.get_kitten_by_id(kitten_id)
 
 
 @router.post("/", response_model=KittenView, description="Добавление информации о котёнке")
 async def create_kitten(
         kitten: KittenCreate,
+        codec: Codec = Depends(response_codec),
+        service: KittenService = Depends(service_factory.create_kitten_service)
+):
+    return negotiated_view(await service.create_kitten(kitten), codec)
+
+
+@router.post("/bulk", response_model=List[KittenBulkResult], description="Массовое добавление котят")
+async def create_kittens(
+        kittens: Annotated[List[KittenCreate], Field(min_length=1, max_length=BULK_MAX_ITEMS)],
         service: KittenService = Depends(service_factory.create_kitten_service)
 ):
-    return await service.create_kitten(kitten)
+    return await service.create_kittens(kittens)
 
 
 @router.put("/{kitten_id}", response_model=KittenView, description="Изменение информации о котёнке")
 async def update_kitten(
     kitten_id: int,
     kitten_data: KittenUpdate,
+    codec: Codec = Depends(response_codec),
+    service: KittenService = Depends(service_factory.create_kitten_service)
+):
+    return negotiated_view(await service.update_kitten(kitten_id, kitten_data), codec)
+
+
+@router.patch("/bulk", response_model=KittenBulkOutcome, description="Массовое изменение информации о котятах")
+async def patch_kittens(
+    patches: Annotated[List[KittenBulkPatch], Field(min_length=1, max_length=BULK_MAX_ITEMS)],
     service: KittenService = Depends(service_factory.create_kitten_service)
 ):
-    return await service.update_kitten(kitten_id, kitten_data)
+    return await service.patch_kittens(patches)
 
 
 @router.patch("/{kitten_id}", response_model=KittenView, description="Изменение информации о котёнке")
 async def patch_kitten(
     kitten_id: int,
     kitten_data: KittenPatch,
+    codec: Codec = Depends(response_codec),
+    service: KittenService = Depends(service_factory.create_kitten_service)
+):
+    return negotiated_view(await service.patch_kitten(kitten_id, kitten_data), codec)
+
+
+@router.delete("/", response_model=KittenBulkOutcome, description="Массовое удаление информации о котятах")
+async def delete_kittens(
+    ids: List[int] = Query(..., min_length=1, max_length=BULK_MAX_ITEMS, description="ID котят для удаления"),
     service: KittenService = Depends(service_factory.create_kitten_service)
 ):
-    return await service.patch_kitten(kitten_id, kitten_data)
+    return await service.delete_kittens(ids)
 
 
 @router.delete("/{kitten_id}", response_model=bool, description="Удаление информации о котёнке")
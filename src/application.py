@@ -6,18 +6,38 @@ from fastapi import FastAPI
 from sqlalchemy.exc import IntegrityError
 from starlette.responses import JSONResponse
 
+from src.admission import AdmissionMiddleware
 from src.api.breed import router as breed_router
+from src.api.health import router as health_router
 from src.api.kitten import router as kitten_router
+from src.api.metrics import router as metrics_router
+from src.compression import CompressionMiddleware
+from src.factory import service_factory
+from src.lifecycle import InFlightMiddleware, lifecycle
+from src.metrics import MetricsMiddleware
+from src.settings import Settings, get_settings
 
 logger = logging.getLogger(__name__)
 
 
+def begin_shutdown() -> None:
+    # Потоки ленты изменений бесконечны: закрываем их сразу, клиенты переподключатся к другому воркеру
+    lifecycle.ready = False
+    service_factory.changes.close()
+
+
 @asynccontextmanager
 async def lifespan(_application: FastAPI) -> AsyncGenerator:
     # Startup
+    await service_factory.startup()
+    lifecycle.ready = True
     logger.info(f"Start")
     yield
     # Shutdown
+    begin_shutdown()
+    await lifecycle.drain(get_settings(Settings).shutdown_drain_timeout)
+    await service_factory.shutdown()
+    logger.info("Stop")
 
 
 
@@ -25,6 +45,13 @@ def create_app() -> FastAPI:
     app = FastAPI(lifespan=lifespan)
     app.include_router(kitten_router)
     app.include_router(breed_router)
+    app.include_router(metrics_router)
+    app.include_router(health_router)
+    app.add_middleware(CompressionMiddleware, settings=get_settings(Settings).compression)
+    # Отказы по перегрузке попадают в метрики как 503
+    app.add_middleware(AdmissionMiddleware, settings=get_settings(Settings).admission)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(InFlightMiddleware, lifecycle=lifecycle)
     return app
 
 app = create_app()
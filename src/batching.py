@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Sequence, Set, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+Flush = Callable[[List[T]], Awaitable[Sequence[Union[R, BaseException]]]]
+
+
+class MicroBatcher(Generic[T, R]):
+    # Конкурентные одиночные записи копятся до max_items штук или max_delay секунд
+    # и уходят одной пачкой в одной транзакции; каждый вызывающий получает свой результат или свою ошибку.
+    # Пачка пишется в отдельной задаче с чистым контекстом: она не принадлежит ни одному из запросов
+    def __init__(self, flush: Flush, max_items: int = 100, max_delay: float = 0.005):
+        self.flush = flush
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_pending)
+        return await future
+
+    def _flush_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Запросы, отменённые до записи пачки, в неё не попадают
+        batch = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._write(batch), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        items = [item for item, _ in batch]
+        try:
+            try:
+                results = list(await self.flush(items))
+            except Exception as exc:
+                if len(batch) == 1:
+                    results = [exc]
+                else:
+                    # Пачка откатилась целиком: повторяем поштучно, чтобы ошибка досталась только своей записи
+                    results = [await self._write_one(item) for item in items]
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # Запись прервана отменой или BaseException: ожидающие не должны висеть вечно
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Batched write did not complete"))
+
+    async def _write_one(self, item: T) -> Union[R, BaseException]:
+        try:
+            return (await self.flush([item]))[0]
+        except Exception as exc:
+            return exc
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"batches": self.batches, "items": self.items, "pending": len(self._pending)}
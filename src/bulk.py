@@ -0,0 +1,332 @@
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Index, Table, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from src.models import SEARCH_INDEX_DDL, Breed, Kitten
+
+logger = logging.getLogger(__name__)
+
+ENTITIES = ("breeds", "kittens")
+FORMATS = ("csv", "ndjson")
+EXPORT_COLUMNS = {
+    "breeds": ("id", "name"),
+    # Порода выгружается именем: при загрузке в другую базу оно снова превращается в id
+    "kittens": ("id", "breed", "color", "age", "description"),
+}
+PROGRESS_INTERVAL = 5.0
+
+Record = Tuple[int, Dict[str, Any]]
+
+
+class BulkError(Exception):
+    pass
+
+
+def detect_format(path: str, explicit: Optional[str] = None) -> str:
+    if explicit:
+        return explicit
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".ndjson", ".jsonl", ".json") or path == "-":
+        return "ndjson"
+    raise BulkError(f"Cannot detect format of {path}, pass --format")
+
+
+@contextlib.contextmanager
+def _open(path: str) -> Iterator[IO[str]]:
+    if path != "-":
+        with open(path, newline="", encoding="utf-8") as file:
+            yield file
+        return
+    # stdin читаем в той же кодировке, что и файлы, и не закрываем его после чтения
+    file = io.TextIOWrapper(sys.stdin.buffer, newline="", encoding="utf-8")
+    try:
+        yield file
+    finally:
+        file.detach()
+
+
+def read_records(path: str, fmt: str) -> Iterator[Record]:
+    # Читаем построчно, вместе с номером строки для сообщений об ошибках; "-" — stdin
+    with _open(path) as file:
+        if fmt == "csv":
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line, raw in enumerate(file, 1):
+            if not raw.strip():
+                continue
+            try:
+                yield line, json.loads(raw)
+            except json.JSONDecodeError as exc:
+                raise BulkError(f"line {line}: invalid JSON: {exc}") from exc
+
+
+def _chunks(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    chunk: List[Record] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _value(record: Dict[str, Any], name: str, line: int) -> Any:
+    value = record.get(name)
+    if value is None or value == "":
+        raise BulkError(f"line {line}: {name} is required")
+    return value
+
+
+def _integer(record: Dict[str, Any], name: str, line: int, required: bool = True) -> Optional[int]:
+    if not required and record.get(name) in (None, ""):
+        return None
+    try:
+        return int(_value(record, name, line))
+    except (TypeError, ValueError):
+        raise BulkError(f"line {line}: {name} must be an integer, got {record.get(name)!r}") from None
+
+
+class Checkpoint:
+    # Номера загруженных пачек: каждая пачка коммитится отдельно, и при повторном запуске
+    # уже загруженные пропускаются, даже если параллельные воркеры завершали их не по порядку.
+    # Файл, перезаписанный с тем же размером, узнаём по времени изменения
+    def __init__(self, path: Optional[str], source: str, chunk_size: int):
+        if source == "-":
+            raise BulkError("Cannot resume an import from stdin, pass --no-resume")
+        self.path = path
+        stat = os.stat(source)
+        self.identity = {
+            "source": os.path.abspath(source), "size": stat.st_size, "mtime": stat.st_mtime_ns, "chunk_size": chunk_size,
+        }
+        self.done: Set[int] = set()
+        self.rows = 0
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                saved = json.load(file)
+            if {key: saved.get(key) for key in self.identity} != self.identity:
+                raise BulkError(f"Checkpoint {path} belongs to another file or chunk size, remove it to start over")
+            self.done = set(saved["done"])
+            self.rows = saved["rows"]
+
+    def mark(self, index: int, rows: int) -> None:
+        self.done.add(index)
+        self.rows += rows
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump({**self.identity, "rows": self.rows, "done": sorted(self.done)}, file)
+        os.replace(tmp, self.path)
+
+    def finish(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkImporter:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        entity: str,
+        chunk_size: int = 10000,
+        workers: int = 4,
+        defer_indexes: bool = False,
+        checkpoint: Optional[Checkpoint] = None,
+    ):
+        self.engine = engine
+        self.entity = entity
+        self.table: Table = Breed.__table__ if entity == "breeds" else Kitten.__table__
+        self.postgres = engine.dialect.name == "postgresql"
+        self.chunk_size = chunk_size
+        # SQLite сериализует запись, параллельные воркеры только ждали бы блокировку
+        self.workers = max(1, workers) if self.postgres else 1
+        self.defer_indexes = defer_indexes
+        self.checkpoint = checkpoint
+        self.breeds: Dict[str, int] = {}
+        self.breed_ids: Set[int] = set()
+        self.explicit_ids = False
+        self._rows = 0
+        self._started = 0.0
+        self._reported = 0.0
+
+    async def run(self, records: Iterable[Record]) -> int:
+        self._started = self._reported = time.monotonic()
+        if self.entity == "kittens":
+            async with self.engine.connect() as conn:
+                self.breeds = dict((await conn.execute(select(Breed.name, Breed.id))).all())
+            self.breed_ids = set(self.breeds.values())
+        if self.defer_indexes:
+            await self._drop_indexes()
+        try:
+            # Очередь ограничена, поэтому файл читается по мере загрузки, а не целиком в память
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+            async with asyncio.TaskGroup() as group:
+                for _ in range(self.workers):
+                    group.create_task(self._worker(queue))
+                for index, chunk in enumerate(_chunks(records, self.chunk_size)):
+                    if self.checkpoint is not None and index in self.checkpoint.done:
+                        continue
+                    await queue.put((index, chunk))
+                for _ in range(self.workers):
+                    await queue.put(None)
+        except ExceptionGroup as group:
+            # Остальные воркеры к этому моменту отменены, причина — первая ошибка
+            raise group.exceptions[0] from None
+        finally:
+            if self.defer_indexes:
+                await self._create_indexes()
+        if self.explicit_ids and self.postgres:
+            # После вставки с явными id последовательность должна продолжиться за максимальным
+            async with self.engine.begin() as conn:
+                await conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{self.table.name}', 'id'), max(id)) FROM {self.table.name}"
+                ))
+        if self.checkpoint is not None:
+            self.checkpoint.finish()
+        logger.info("%s: imported %d rows in %.1fs", self.entity, self._rows, time.monotonic() - self._started)
+        return self._rows
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, chunk = item
+            rows = [self._convert(record, line) for line, record in chunk]
+            await self._load(rows)
+            if self.checkpoint is not None:
+                self.checkpoint.mark(index, len(rows))
+            self._progress(len(rows))
+
+    def _convert(self, record: Dict[str, Any], line: int) -> Dict[str, Any]:
+        row: Dict[str, Any] = {"id": _integer(record, "id", line, required=False)}
+        if self.entity == "breeds":
+            row["name"] = str(_value(record, "name", line))
+            return row
+        if record.get("breed") not in (None, ""):
+            breed_id = self.breeds.get(record["breed"])
+            if breed_id is None:
+                raise BulkError(f"line {line}: unknown breed {record['breed']!r}")
+        else:
+            breed_id = _integer(record, "breed_id", line)
+            if breed_id not in self.breed_ids:
+                raise BulkError(f"line {line}: unknown breed_id {breed_id}")
+        row.update(
+            breed_id=breed_id,
+            color=str(_value(record, "color", line)),
+            age=_integer(record, "age", line),
+            description=str(_value(record, "description", line)),
+        )
+        return row
+
+    def _columns(self, rows: Sequence[Dict[str, Any]]) -> List[str]:
+        with_id = sum(row["id"] is not None for row in rows)
+        if with_id and with_id != len(rows):
+            raise BulkError("id must be given either for every row or for none")
+        if with_id:
+            self.explicit_ids = True
+        return [name for name in rows[0] if name != "id" or with_id]
+
+    async def _load(self, rows: List[Dict[str, Any]]) -> None:
+        columns = self._columns(rows)
+        if self.postgres and self.entity == "kittens":
+            # COPY в обход построчного INSERT; триггеры сводки по породам срабатывают и на нём
+            async with self.engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                async with raw.transaction():
+                    await raw.copy_records_to_table(
+                        self.table.name, records=[tuple(row[name] for name in columns) for row in rows], columns=columns
+                    )
+            return
+        statement = insert(self.table)
+        if self.entity == "breeds":
+            # Имя породы уникально: повторная загрузка того же файла не падает на уже существующих
+            dialect_insert = postgresql.insert if self.postgres else sqlite.insert
+            statement = dialect_insert(self.table).on_conflict_do_nothing(index_elements=["name"])
+        async with self.engine.begin() as conn:
+            await conn.execute(statement, [{name: row[name] for name in columns} for row in rows])
+
+    def _progress(self, rows: int) -> None:
+        self._rows += rows
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            logger.info(
+                "%s: %d rows loaded, %.0f rows/s", self.entity, self._rows, self._rows / (now - self._started)
+            )
+
+    def _deferrable_indexes(self) -> List[Index]:
+        # Уникальные индексы нужны для ON CONFLICT и проверки данных, их не трогаем
+        return sorted((index for index in self.table.indexes if not index.unique), key=lambda index: index.name)
+
+    async def _drop_indexes(self) -> None:
+        async with self.engine.begin() as conn:
+            for index in self._deferrable_indexes():
+                await conn.execute(DropIndex(index, if_exists=True))
+            if self.postgres and self.entity == "kittens":
+                await conn.execute(text("DROP INDEX IF EXISTS ix_kittens_search_vector"))
+        logger.info("%s: secondary indexes dropped until the import finishes", self.entity)
+
+    async def _create_indexes(self) -> None:
+        started = time.monotonic()
+        statements: List[Any] = [CreateIndex(index, if_not_exists=True) for index in self._deferrable_indexes()]
+        if self.postgres and self.entity == "kittens":
+            statements.append(text(SEARCH_INDEX_DDL.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS")))
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def create(statement) -> None:
+            # В PostgreSQL индексы строятся параллельно, каждый на своём соединении
+            async with semaphore, self.engine.begin() as conn:
+                await conn.execute(statement)
+
+        await asyncio.gather(*(create(statement) for statement in statements))
+        logger.info("%s: indexes rebuilt in %.1fs", self.entity, time.monotonic() - started)
+
+
+def _export_query(entity: str):
+    if entity == "breeds":
+        return select(Breed.id, Breed.name).order_by(Breed.id)
+    return (
+        select(Kitten.id, Breed.name.label("breed"), Kitten.color, Kitten.age, Kitten.description)
+        .join(Breed, Kitten.breed_id == Breed.id)
+        .order_by(Kitten.id)
+    )
+
+
+def _row_writer(out: IO[str], fmt: str, columns: Sequence[str]) -> Callable[[Sequence[Any]], None]:
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        return writer.writerow
+    return lambda row: out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+
+
+async def export_table(engine: AsyncEngine, entity: str, out: IO[str], fmt: str, batch_size: int = 5000) -> int:
+    # Серверный курсор: в памяти не больше одной пачки строк независимо от размера таблицы
+    write = _row_writer(out, fmt, EXPORT_COLUMNS[entity])
+    count = 0
+    async with engine.connect() as conn:
+        result = await conn.stream(_export_query(entity).execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            for row in rows:
+                write(row)
+            count += len(rows)
+    logger.info("%s: exported %d rows", entity, count)
+    return count
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+from urllib.parse import urlparse
+
+from src.encoding import JSON_MEDIA_TYPE, MEDIA_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Метка сброшенной записи: пока она жива, кэш не заполняется повторно, чтобы чтение
+# с отстающей реплики не вернуло в кэш версию до записи. Тела в кэше — JSON, с ней не совпадут
+TOMBSTONE = b"\x00invalidated"
+
+
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    async def add(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    async def delete(self, *keys: str) -> None:
+        ...
+
+    async def mark(self, keys: List[str], value: bytes, ttl: float) -> None:
+        ...
+
+
+class MemoryCache:
+    # Кэш живёт в памяти процесса: при нескольких воркерах инвалидация
+    # видна только записавшему воркеру, остальные догоняют по TTL
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> None:
+        # Записываем, только если ключа нет (как SET NX)
+        if await self.get(key) is None:
+            await self.set(key, value, ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._items.pop(key, None)
+
+    async def mark(self, keys: List[str], value: bytes, ttl: float) -> None:
+        for key in keys:
+            await self.set(key, value, ttl)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisClient:
+    # Минимальный клиент протокола RESP с небольшим пулом соединений.
+    # Каждая операция ограничена timeout: медленный Redis хуже, чем промах кэша
+    def __init__(self, url: str, pool_size: int = 4, timeout: float = 0.25, connect_timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: List[RedisConnection] = []
+
+    async def execute(self, *args: Any) -> Any:
+        return (await self.pipeline([args]))[0]
+
+    async def pipeline(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        # Команды отправляются одним пакетом, ответы читаются по порядку
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.connect_timeout)
+                replies = await asyncio.wait_for(self._call(connection, commands), self.timeout)
+            except BaseException:
+                # Ответ мог остаться непрочитанным, соединение больше нельзя переиспользовать
+                if connection is not None:
+                    connection.close()
+                raise
+            self._idle.append(connection)
+        errors = [reply for reply in replies if isinstance(reply, RedisError)]
+        if errors:
+            raise errors[0]
+        return replies
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _connect(self) -> RedisConnection:
+        connection = RedisConnection(*await asyncio.open_connection(self.host, self.port))
+        try:
+            setup = []
+            if self.password:
+                setup.append(("AUTH", self.password))
+            if self.db:
+                setup.append(("SELECT", self.db))
+            for reply in await self._call(connection, setup):
+                if isinstance(reply, RedisError):
+                    raise reply
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    async def _call(self, connection: RedisConnection, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        if not commands:
+            return []
+        connection.writer.write(b"".join(self._encode(args) for args in commands))
+        await connection.writer.drain()
+        return [await self._read_reply(connection.reader) for _ in commands]
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    @classmethod
+    async def _read_reply(cls, reader: asyncio.StreamReader) -> Any:
+        # Ошибка команды возвращается, а не выбрасывается: остальные ответы пакета ещё нужно дочитать
+        line = await reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            return RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await cls._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+
+class RedisCache:
+    def __init__(self, client: RedisClient):
+        self.client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.execute("SET", key, value, "PX", int(ttl * 1000))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.execute("SET", key, value, "PX", int(ttl * 1000), "NX")
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.execute("DEL", *keys)
+
+    async def mark(self, keys: List[str], value: bytes, ttl: float) -> None:
+        if keys:
+            await self.client.pipeline([("SET", key, value, "PX", int(ttl * 1000)) for key in keys])
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    errors: int = 0
+
+
+# asyncio.TimeoutError — превышен timeout клиента Redis
+CACHE_ERRORS = (OSError, RedisError, asyncio.IncompleteReadError, asyncio.TimeoutError)
+
+
+class EntityCache:
+    # Cache-aside: промах читается из базы и кладётся в кэш, запись сбрасывает ключ.
+    # Сброс оставляет метку на invalidation_hold секунд — дольше отставания реплик.
+    # Тело хранится готовым для каждого формата ответа, сброс затрагивает все форматы
+    def __init__(
+        self,
+        backend: CacheBackend,
+        prefix: str,
+        ttl: float = 60.0,
+        invalidation_hold: float = 5.0,
+        media_types: Sequence[str] = MEDIA_TYPES,
+    ):
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+        self.invalidation_hold = invalidation_hold
+        self.media_types = media_types
+        self.stats = CacheStats()
+
+    def _key(self, entity_id: Any, media_type: str) -> str:
+        return f"{self.prefix}:{entity_id}:{media_type}"
+
+    async def get(self, entity_id: Any, media_type: str = JSON_MEDIA_TYPE) -> Optional[bytes]:
+        key = self._key(entity_id, media_type)
+        try:
+            value = await self.backend.get(key)
+        except CACHE_ERRORS:
+            # Недоступный кэш не должен ронять запрос: идём в базу
+            logger.warning("Cache get failed for %s", key, exc_info=True)
+            self.stats.errors += 1
+            value = None
+        if value is None or value == TOMBSTONE:
+            value = None
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    async def set(self, entity_id: Any, value: bytes, media_type: str = JSON_MEDIA_TYPE) -> None:
+        key = self._key(entity_id, media_type)
+        try:
+            # Не перезаписываем ни свежую запись, ни метку сброса
+            await self.backend.add(key, value, self.ttl)
+        except CACHE_ERRORS:
+            logger.warning("Cache set failed for %s", key, exc_info=True)
+            self.stats.errors += 1
+
+    async def invalidate(self, *entity_ids: Any) -> None:
+        try:
+            keys = [self._key(entity_id, media_type) for entity_id in entity_ids for media_type in self.media_types]
+            if self.invalidation_hold > 0:
+                await self.backend.mark(keys, TOMBSTONE, self.invalidation_hold)
+            else:
+                await self.backend.delete(*keys)
+        except CACHE_ERRORS:
+            logger.warning("Cache invalidation failed for %s", entity_ids, exc_info=True)
+            self.stats.errors += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"hits": self.stats.hits, "misses": self.stats.misses, "errors": self.stats.errors}
+
+
+def create_cache_backend(
+    backend: str,
+    redis_url: Optional[str] = None,
+    max_size: int = 10000,
+    redis_pool_size: int = 4,
+    redis_timeout: float = 0.25,
+) -> Optional[CacheBackend]:
+    if backend == "memory":
+        return MemoryCache(max_size=max_size)
+    if backend == "redis":
+        if not redis_url:
+            raise ValueError("redis_url is required for the redis cache backend")
+        return RedisCache(RedisClient(redis_url, pool_size=redis_pool_size, timeout=redis_timeout))
+    return None
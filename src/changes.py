@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+CREATED, UPDATED, DELETED, RESET = "created", "updated", "deleted", "reset"
+# Ограничение PostgreSQL на payload NOTIFY — 8000 байт; большие события уходят без данных
+NOTIFY_PAYLOAD_LIMIT = 7900
+RECONNECT_DELAY = 1.0
+
+Change = Tuple[str, int, Optional[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    id: int
+    type: str
+    kitten_id: int
+    data: Optional[Dict[str, Any]] = None
+
+    def encode(self) -> bytes:
+        data = self.data if self.data is not None else {"id": self.kitten_id}
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+class Subscription:
+    # Буфер подписчика ограничен: тот, кто не успевает читать, отключается и переподключается
+    # с Last-Event-ID, а не заставляет ленту копить для него события
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.dropped = False
+        self.closed = False
+        self._buffer: Deque[ChangeEvent] = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, event: ChangeEvent) -> bool:
+        if self.closed:
+            return False
+        if len(self._buffer) >= self.buffer_size:
+            self.dropped = True
+            self.close()
+            return False
+        self._buffer.append(event)
+        self._ready.set()
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def next(self, timeout: float) -> Optional[List[ChangeEvent]]:
+        # Пустой список — за timeout ничего не пришло, None — подписка закрыта
+        if not self._buffer and not self.closed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._ready.clear()
+        if self.dropped or (self.closed and not self._buffer):
+            return None
+        events = list(self._buffer)
+        self._buffer.clear()
+        return events
+
+
+class ChangeFeed:
+    # Лента изменений котят внутри процесса: события раздаются всем подписчикам
+    # и хранятся в ограниченном журнале для продолжения с Last-Event-ID.
+    # С мостом PostgreSQL события публикуются через NOTIFY и приходят сюда от всех воркеров
+    def __init__(self, replay_size: int = 1000, buffer_size: int = 256):
+        self.replay_size = replay_size
+        self.buffer_size = buffer_size
+        self.bridge: Optional["PostgresBridge"] = None
+        self.closed = False
+        self.published = 0
+        self.dropped = 0
+        self._log: Deque[ChangeEvent] = deque()
+        self._subscribers: Set[Subscription] = set()
+        self._last_id = 0
+        # События с id <= floor из журнала уже вытеснены или прошли до старта: с них не продолжить
+        self._floor: Optional[int] = None
+
+    async def publish(self, changes: List[Change]) -> None:
+        if not changes:
+            return
+        if self.bridge is not None:
+            await self.bridge.send(changes)
+            return
+        for change_type, kitten_id, data in changes:
+            self.deliver(ChangeEvent(self._last_id + 1, change_type, kitten_id, data))
+
+    def deliver(self, event: ChangeEvent) -> None:
+        if self._floor is None:
+            self._floor = event.id - 1
+        if len(self._log) >= self.replay_size:
+            self._floor = self._log.popleft().id
+        self._log.append(event)
+        self._last_id = max(self._last_id, event.id)
+        self._fan_out(event)
+
+    def deliver_late(self, event: ChangeEvent) -> None:
+        # Событие пришло после более поздних: подключённым его отдаём, но в журнал оно не встанет
+        # по порядку, поэтому продолжение с уже выданных id превращается в reset
+        self._log.clear()
+        self._floor = self._last_id + 1
+        self._fan_out(event)
+
+    def _fan_out(self, event: ChangeEvent) -> None:
+        self.published += 1
+        for subscription in list(self._subscribers):
+            if not subscription.push(event):
+                self._subscribers.discard(subscription)
+                if subscription.dropped:
+                    self.dropped += 1
+                    logger.warning("Dropped a slow change feed subscriber")
+
+    def reset(self) -> None:
+        # Часть событий могла пройти мимо (потеряно соединение моста): продолжить по журналу нельзя
+        self._log.clear()
+        self._floor = None
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Tuple[Subscription, List[ChangeEvent]]:
+        subscription = Subscription(self.buffer_size)
+        if self.closed:
+            subscription.close()
+        else:
+            self._subscribers.add(subscription)
+        if last_event_id is None:
+            return subscription, []
+        if self._floor is None or last_event_id < self._floor:
+            # Клиенту нужно перечитать состояние; id последнего известного события — точка продолжения
+            return subscription, [ChangeEvent(self._last_id, RESET, 0, {})]
+        return subscription, [event for event in self._log if event.id > last_event_id]
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def close(self) -> None:
+        # При остановке закрываем потоки, чтобы они не держали плавное завершение
+        self.closed = True
+        for subscription in self._subscribers:
+            subscription.close()
+        self._subscribers.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "last_event_id": self._last_id,
+        }
+
+
+async def event_stream(
+    feed: ChangeFeed, last_event_id: Optional[int], keepalive: float, retry_ms: int
+) -> AsyncIterator[bytes]:
+    subscription, replay = feed.subscribe(last_event_id)
+    try:
+        yield f"retry: {retry_ms}\n\n".encode()
+        for event in replay:
+            yield event.encode()
+        while True:
+            events = await subscription.next(keepalive)
+            if events is None:
+                return
+            if not events:
+                # Комментарий не даёт прокси закрыть простаивающее соединение
+                yield b": keepalive\n\n"
+                continue
+            yield b"".join(event.encode() for event in events)
+    finally:
+        feed.unsubscribe(subscription)
+
+
+class PostgresBridge:
+    # Отдельное соединение asyncpg слушает канал; номера событий выдаёт общая последовательность.
+    # nextval берётся до коммита, поэтому параллельные транзакции уведомляют не по порядку номеров:
+    # пришедшие раньше соседей события ждут пропущенный номер до reorder_window секунд.
+    # Продолжение на другом воркере — по возможности: событие, опоздавшее дольше окна,
+    # и потеря соединения слушателя заставляют продолжающих клиентов перечитать состояние
+    def __init__(self, feed: ChangeFeed, engine: AsyncEngine, channel: str, reorder_window: float = 0.5):
+        self.feed = feed
+        self.engine = engine
+        self.channel = channel
+        self.reorder_window = reorder_window
+        self._connection: Optional[asyncpg.Connection] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._stopped = False
+        self._pending: Dict[int, ChangeEvent] = {}
+        self._next_id: Optional[int] = None
+        self._gap_timer: Optional[asyncio.TimerHandle] = None
+
+    async def start(self) -> None:
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection = await asyncpg.connect(dsn)
+        await self._connection.add_listener(self.channel, self._on_notify)
+        self._connection.add_termination_listener(self._on_lost)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        self._flush()
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+
+    async def send(self, changes: List[Change]) -> None:
+        params = []
+        for change_type, kitten_id, data in changes:
+            payload = json.dumps({"type": change_type, "id": kitten_id, "data": data}, ensure_ascii=False)
+            if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+                payload = json.dumps({"type": change_type, "id": kitten_id, "data": None})
+            params.append({"channel": self.channel, "payload": payload})
+        # Одна транзакция: уведомления одной пачки доставляются при коммите и в порядке отправки
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, nextval('kitten_changes_id_seq') || ':' || :payload)"), params
+            )
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        event_id, _, body = payload.partition(":")
+        change = json.loads(body)
+        self._receive(ChangeEvent(int(event_id), change["type"], change["id"], change["data"]))
+
+    def _receive(self, event: ChangeEvent) -> None:
+        if self._next_id is None:
+            self._next_id = event.id
+        if event.id < self._next_id:
+            logger.warning("Change event %d arrived after the reorder window", event.id)
+            self.feed.deliver_late(event)
+            return
+        self._pending[event.id] = event
+        self._drain()
+        if self._pending and self._gap_timer is None:
+            self._gap_timer = asyncio.get_running_loop().call_later(self.reorder_window, self._skip_gap)
+
+    def _drain(self) -> None:
+        while self._next_id in self._pending:
+            self.feed.deliver(self._pending.pop(self._next_id))
+            self._next_id += 1
+        if not self._pending and self._gap_timer is not None:
+            self._gap_timer.cancel()
+            self._gap_timer = None
+
+    def _skip_gap(self) -> None:
+        # Пропущенный номер не пришёл за окно: транзакция откатилась или сильно опаздывает
+        self._gap_timer = None
+        if not self._pending:
+            return
+        self._next_id = min(self._pending)
+        self._drain()
+        if self._pending:
+            self._gap_timer = asyncio.get_running_loop().call_later(self.reorder_window, self._skip_gap)
+
+    def _flush(self) -> None:
+        # Отдаём всё накопленное по порядку, не дожидаясь пропущенных номеров
+        if self._gap_timer is not None:
+            self._gap_timer.cancel()
+            self._gap_timer = None
+        for event_id in sorted(self._pending):
+            self.feed.deliver(self._pending.pop(event_id))
+        self._next_id = None
+
+    def _on_lost(self, connection) -> None:
+        if self._stopped:
+            return
+        logger.warning("Change feed listener connection lost, reconnecting")
+        self._flush()
+        self.feed.reset()
+        self._reconnect = asyncio.ensure_future(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        while not self._stopped:
+            try:
+                await self.start()
+                return
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(RECONNECT_DELAY)
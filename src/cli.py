@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from src.bulk import ENTITIES, FORMATS, BulkError, BulkImporter, Checkpoint, detect_format, export_table, read_records
+from src.database import Database
+from src.repositories.breed import BreedRepository
+from src.settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def _database(args: argparse.Namespace) -> Database:
+    return Database(args.database_url or str(get_settings(Settings).postgres.url), echo=False)
+
+
+async def rebuild_breed_stats(args: argparse.Namespace) -> None:
+    db = _database(args)
+    try:
+        await BreedRepository(db.session).rebuild_breed_stats()
+        logger.info("Breed stats rebuilt")
+    finally:
+        await db.dispose()
+
+
+async def import_data(args: argparse.Namespace) -> None:
+    fmt = detect_format(args.path, args.format)
+    checkpoint = None
+    # Поток из stdin не перечитать с начала: файл прогресса для него ведётся, только если задан явно
+    if not args.no_resume and (args.path != "-" or args.checkpoint):
+        checkpoint = Checkpoint(args.checkpoint or f"{args.path}.progress", args.path, args.chunk_size)
+        if checkpoint.done:
+            logger.info("Resuming %s: %d rows already loaded", args.path, checkpoint.rows)
+    db = _database(args)
+    try:
+        importer = BulkImporter(
+            db.engine, args.entity, chunk_size=args.chunk_size, workers=args.workers,
+            defer_indexes=args.defer_indexes, checkpoint=checkpoint,
+        )
+        await importer.run(read_records(args.path, fmt))
+    finally:
+        await db.dispose()
+
+
+async def export_data(args: argparse.Namespace) -> None:
+    fmt = detect_format(args.path, args.format)
+    db = _database(args)
+    try:
+        if args.path == "-":
+            await export_table(db.engine, args.entity, sys.stdout, fmt, args.batch_size)
+        else:
+            with open(args.path, "w", newline="", encoding="utf-8") as out:
+                await export_table(db.engine, args.entity, out, fmt, args.batch_size)
+    finally:
+        await db.dispose()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.cli")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--database-url", help="По умолчанию — база из настроек приложения")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-breed-stats", parents=[common], help="Пересчитать сводку по породам с нуля")
+    rebuild.set_defaults(handler=rebuild_breed_stats)
+
+    load = commands.add_parser("import", parents=[common], help="Загрузить породы или котят из CSV/NDJSON")
+    load.add_argument("entity", choices=ENTITIES)
+    load.add_argument("path", help="- — читать stdin, без файла прогресса")
+    load.add_argument("--format", choices=FORMATS, help="По умолчанию — по расширению файла")
+    load.add_argument("--chunk-size", type=int, default=10000, help="Строк в одной транзакции")
+    load.add_argument("--workers", type=int, default=4, help="Параллельных COPY в PostgreSQL")
+    load.add_argument("--defer-indexes", action="store_true", help="Снять вторичные индексы и построить их после загрузки")
+    load.add_argument("--checkpoint", help="Файл прогресса для продолжения, по умолчанию <path>.progress")
+    load.add_argument("--no-resume", action="store_true", help="Не вести файл прогресса")
+    load.set_defaults(handler=import_data)
+
+    dump = commands.add_parser("export", parents=[common], help="Выгрузить породы или котят в CSV/NDJSON")
+    dump.add_argument("entity", choices=ENTITIES)
+    dump.add_argument("path", nargs="?", default="-", help="По умолчанию — stdout")
+    dump.add_argument("--format", choices=FORMATS)
+    dump.add_argument("--batch-size", type=int, default=5000)
+    dump.set_defaults(handler=export_data)
+    return parser
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args(argv)
+    try:
+        asyncio.run(args.handler(args))
+    except BulkError as exc:
+        logger.error("%s", exc)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
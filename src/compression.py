@@ -0,0 +1,137 @@
+import zlib
+from typing import Dict, Optional
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from src.metrics import route_template
+from src.settings import CompressionLevel, CompressionSettings
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/msgpack", "text/plain", "text/html", "text/csv",
+)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    # Brotli, если клиент его принимает и модуль установлен, иначе gzip; q=0 означает отказ
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *params = (item.strip() for item in part.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    scored = [(accepted.get(encoding, accepted.get("*", 0.0)), encoding) for encoding in ("br", "gzip")]
+    best = max(scored, key=lambda item: item[0])
+    return best[1] if best[0] > 0 else None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, level: CompressionLevel):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=level.brotli)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(level.gzip, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        # Промежуточные куски сбрасываются сразу, чтобы потоковая выдача не копилась в буфере
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def weaken_etag(headers: MutableHeaders) -> None:
+    # Сжатое представление — другие байты, поэтому сильный ETag исходного ответа для него неверен.
+    # Слабый тег сохраняет значение: If-None-Match сравнивает слабо и принимает оба варианта
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+
+class CompressionMiddleware:
+    def __init__(self, app, settings: CompressionSettings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.enabled:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(scope, send, encoding, self.settings))
+
+
+class _CompressingSend:
+    def __init__(self, scope, send, encoding: str, settings: CompressionSettings):
+        self.scope = scope
+        self.send = send
+        self.encoding = encoding
+        self.settings = settings
+        self.start: Optional[dict] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    def _level(self) -> CompressionLevel:
+        # Шаблон пути известен к началу ответа: роутер уже записал маршрут в scope
+        return self.settings.routes.get(route_template(self.scope), self.settings.default)
+
+    def _should_compress(self, headers: MutableHeaders) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").split(";")[0].strip()
+        return content_type in COMPRESSIBLE_TYPES
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            compressible = self._should_compress(headers)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if not compressible or (not more_body and len(body) < self.settings.minimum_size):
+                self.passthrough = True
+                if self.start["status"] == 304:
+                    # 304 без тела не сжимается, но подтверждает сжатое представление с тем же тегом
+                    weaken_etag(headers)
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding, self._level())
+            headers["Content-Encoding"] = self.encoding
+            weaken_etag(headers)
+            if more_body:
+                # Длина потокового ответа заранее неизвестна
+                del headers["Content-Length"]
+            body = self.compressor.compress(body, final=not more_body)
+            if not more_body:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        await self.send({
+            "type": "http.response.body",
+            "body": self.compressor.compress(body, final=not more_body),
+            "more_body": more_body,
+        })
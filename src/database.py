@@ -1,34 +1,247 @@
+import itertools
 import logging
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import make_url, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
+from src.metrics import instrument_engine
+from src.query_log import QueryLog, attach as attach_query_log
+from src.settings import PoolSettings
+
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Выставляется после обращения к основной базе, чтобы последующие чтения
+# в рамках того же запроса видели только что записанные данные
+_primary_pinned: ContextVar[bool] = ContextVar("primary_pinned", default=False)
+
+
+
+def primary_pinned() -> bool:
+    return _primary_pinned.get()
+
+
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+
 
 class Database:
-    def __init__(self, db_url: str) -> None:
-        self._engine = create_async_engine(db_url, echo=True)
-        self._session_factory = async_sessionmaker(
+    def __init__(
+        self,
+        db_url: str,
+        replica_urls: Sequence[str] = (),
+        replica_strategy: str = ROUND_ROBIN,
+        echo: bool = True,
+        query_log: Optional[QueryLog] = None,
+        pool: Optional[PoolSettings] = None,
+    ) -> None:
+        self._engine = create_async_engine(db_url, **self._engine_options(db_url, echo, pool))
+        self._session_factory = self._make_session_factory(self._engine)
+        self._replica_engines = [
+            create_async_engine(url, **self._engine_options(url, echo, pool)) for url in replica_urls
+        ]
+        self._replica_session_factories = [self._make_session_factory(engine) for engine in self._replica_engines]
+        self._replica_strategy = replica_strategy
+        self._replica_cycle = itertools.cycle(range(len(self._replica_engines)))
+        instrument_engine(self._engine, "primary")
+        for index, engine in enumerate(self._replica_engines):
+            instrument_engine(engine, f"replica-{index}")
+        self._query_log = query_log
+        if query_log is not None:
+            for engine in (self._engine, *self._replica_engines):
+                attach_query_log(engine)
+
+    @staticmethod
+    def _engine_options(db_url: str, echo: bool, pool: Optional[PoolSettings]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"echo": echo}
+        if pool is None:
+            return options
+        url = make_url(db_url)
+        options.update(pool_pre_ping=pool.pre_ping, pool_recycle=pool.recycle)
+        if url.get_backend_name() == "postgresql":
+            # У SQLite свой пул без размеров, параметры очереди имеют смысл только для PostgreSQL
+            options.update(pool_size=pool.size, max_overflow=pool.max_overflow, pool_timeout=pool.timeout)
+            if pool.statement_timeout_ms and url.get_driver_name() == "asyncpg":
+                options["connect_args"] = {"server_settings": {"statement_timeout": str(pool.statement_timeout_ms)}}
+        return options
+
+    @staticmethod
+    def _make_session_factory(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+        return async_sessionmaker(
             autocommit=False,
             autoflush=False,
-            bind=self._engine,
+            expire_on_commit=False,
+            bind=engine,
         )
 
     def create_database(self) -> None:
         Base.metadata.create_all(self._engine)
 
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine
+
+    async def prewarm(self, connections: int) -> None:
+        # Открываем соединения одновременно удерживая их, иначе пул раз за разом выдаст одно и то же
+        for engine in (self._engine, *self._replica_engines):
+            async with AsyncExitStack() as stack:
+                for _ in range(connections):
+                    connection = await stack.enter_async_context(engine.connect())
+                    await connection.execute(text("SELECT 1"))
+
+    async def dispose(self) -> None:
+        for engine in (self._engine, *self._replica_engines):
+            await engine.dispose()
+
+    def unit_of_work(self) -> "UnitOfWork":
+        return UnitOfWork(self._session_factory, lambda: self._read_session_factory()(), self._query_log)
+
     @asynccontextmanager
     async def session(self) -> async_sessionmaker[AsyncSession]:
-        session: AsyncSession = self._session_factory()
+        _primary_pinned.set(True)
+        with self._track_queries():
+            async with self._managed_session(self._session_factory) as session:
+                yield session
+
+    @asynccontextmanager
+    async def read_session(self) -> async_sessionmaker[AsyncSession]:
+        with self._track_queries():
+            async with self._managed_session(self._read_session_factory()) as session:
+                yield session
+
+    def _track_queries(self):
+        return self._query_log.track() if self._query_log is not None else nullcontext()
+
+    def _read_session_factory(self) -> async_sessionmaker[AsyncSession]:
+        if not self._replica_session_factories or _primary_pinned.get():
+            return self._session_factory
+        if self._replica_strategy == LEAST_CONNECTIONS:
+            # Берём реплику с наименьшим числом выданных соединений, при равенстве — по кругу
+            start = next(self._replica_cycle)
+            count = len(self._replica_engines)
+            order = [(start + offset) % count for offset in range(count)]
+            index = min(order, key=lambda i: self._checked_out(self._replica_engines[i]))
+        else:
+            index = next(self._replica_cycle)
+        return self._replica_session_factories[index]
+
+    @staticmethod
+    def _checked_out(engine: AsyncEngine) -> int:
+        checkedout = getattr(engine.pool, "checkedout", None)
+        return checkedout() if checkedout else 0
+
+    @staticmethod
+    @asynccontextmanager
+    async def _managed_session(session_factory: async_sessionmaker[AsyncSession]):
+        session: AsyncSession = session_factory()
         try:
             yield session
+            await session.commit()
         except Exception:
             logger.exception("Session rollback because of exception")
             await session.rollback()
             raise
         finally:
             await session.close()
+
+
+class UnitOfWork:
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        read_session_factory: Optional[Callable[[], AsyncSession]] = None,
+        query_log: Optional[QueryLog] = None,
+    ) -> None:
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory or session_factory
+        self._query_log = query_log
+        self._query_log_token = None
+        self._session: Optional[AsyncSession] = None
+        self._read_session: Optional[AsyncSession] = None
+        self._after_commit: List[Callable[[], Awaitable]] = []
+
+    async def __aenter__(self) -> "UnitOfWork":
+        if self._query_log is not None:
+            self._query_log_token = self._query_log.begin()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                # В строгом режиме превышение бюджета запросов срывает коммит: close() ниже откатит транзакцию
+                self._end_query_log(raise_errors=True)
+                await self.commit()
+                await self._run_after_commit()
+            else:
+                await self.rollback()
+        finally:
+            self._end_query_log(raise_errors=False)
+            await self.close()
+
+    def _end_query_log(self, raise_errors: bool) -> None:
+        token, self._query_log_token = self._query_log_token, None
+        if token is not None:
+            self._query_log.end(token, raise_errors=raise_errors)
+
+    @property
+    def writing(self) -> bool:
+        return self._session is not None
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        if self._session is None:
+            _primary_pinned.set(True)
+            self._session = self._session_factory()
+        yield self._session
+
+    @asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        # После записи читаем из той же сессии, иначе берём реплику один раз на весь запрос
+        if self._session is not None:
+            yield self._session
+            return
+        if self._read_session is None:
+            self._read_session = self._read_session_factory()
+        yield self._read_session
+
+    @asynccontextmanager
+    async def detached_session(self) -> AsyncIterator[AsyncSession]:
+        # Сессия вне запроса: для потоковой выдачи, которая дочитывается после его завершения,
+        # и для чтений, результат которых разделяется между несколькими запросами
+        session = self._read_session_factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    def after_commit(self, callback: Callable[[], Awaitable]) -> None:
+        self._after_commit.append(callback)
+
+    async def _run_after_commit(self) -> None:
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("After commit callback failed")
+
+    async def commit(self) -> None:
+        if self._session is not None:
+            await self._session.commit()
+
+    async def rollback(self) -> None:
+        if self._session is not None:
+            logger.info("Unit of work rollback")
+            await self._session.rollback()
+        self._after_commit.clear()
+
+    async def close(self) -> None:
+        for session in (self._session, self._read_session):
+            if session is not None:
+                await session.close()
+        self._session = self._read_session = None
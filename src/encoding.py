@@ -0,0 +1,85 @@
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+import msgpack
+from fastapi import Header
+from pydantic import BaseModel, TypeAdapter
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+packb = msgpack.packb
+
+
+class Codec(ABC):
+    media_type: str
+
+    @abstractmethod
+    def dump(self, adapter: TypeAdapter, value: Any, by_alias: bool = False) -> bytes:
+        ...
+
+    @abstractmethod
+    def dump_model(self, model: BaseModel, by_alias: bool = True) -> bytes:
+        ...
+
+
+class JsonCodec(Codec):
+    media_type = JSON_MEDIA_TYPE
+
+    def dump(self, adapter: TypeAdapter, value: Any, by_alias: bool = False) -> bytes:
+        return adapter.dump_json(value, by_alias=by_alias)
+
+    def dump_model(self, model: BaseModel, by_alias: bool = True) -> bytes:
+        return model.model_dump_json(by_alias=by_alias).encode()
+
+
+class MsgPackCodec(Codec):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def dump(self, adapter: TypeAdapter, value: Any, by_alias: bool = False) -> bytes:
+        # Одна сериализация в примитивы и одна упаковка, без промежуточного JSON
+        return packb(adapter.dump_python(value, mode="json", by_alias=by_alias))
+
+    def dump_model(self, model: BaseModel, by_alias: bool = True) -> bytes:
+        return packb(model.model_dump(mode="json", by_alias=by_alias))
+
+
+JSON = JsonCodec()
+MSGPACK = MsgPackCodec()
+MEDIA_TYPES = (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)
+
+_CODECS = {
+    JSON_MEDIA_TYPE: JSON,
+    "application/*": JSON,
+    "*/*": JSON,
+    MSGPACK_MEDIA_TYPE: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+}
+
+
+def negotiate(accept: Optional[str]) -> Codec:
+    # JSON по умолчанию; MessagePack — если клиент явно предпочитает его (при равном q — первый в списке)
+    if not accept or "msgpack" not in accept:
+        return JSON
+    best, best_q = JSON, 0.0
+    for part in accept.split(","):
+        media_type, *params = (item.strip() for item in part.split(";"))
+        codec = _CODECS.get(media_type.lower())
+        if codec is None:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+def response_codec(accept: Optional[str] = Header(None)) -> Codec:
+    return negotiate(accept)
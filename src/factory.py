@@ -1,22 +1,118 @@
-from src.database import Database
+from typing import AsyncIterator, List, Optional
+
+from fastapi import Depends
+
+from src.batching import MicroBatcher
+from src.cache import EntityCache, create_cache_backend
+from src.changes import ChangeFeed, PostgresBridge
+from src.database import Database, UnitOfWork
+from src.query_log import QueryLog
 from src.repositories.breed import BreedRepository
 from src.repositories.kitten import KittenRepository
-from src.services.breed import BreedService
+from src.services.breed import BreedService, BreedCache
+from src.schemas.kitten import KittenBulkResult, KittenCreate
 from src.services.kitten import KittenService
 from src.settings import Settings, get_settings
+from src.singleflight import SingleFlight
+
+
+async def get_unit_of_work() -> AsyncIterator[UnitOfWork]:
+    async with service_factory.unit_of_work() as uow:
+        yield uow
 
 
 class ServiceFactory:
     def __init__(self):
-        self._db = Database(str(get_settings(Settings).postgres.url))
+        settings = get_settings(Settings)
+        self._settings = settings
+        # Движок создаётся при старте приложения в lifespan, а не при импорте
+        self._db: Optional[Database] = None
+        self._breed_cache = BreedCache(ttl=settings.breed_cache_ttl)
+        backend = create_cache_backend(
+            settings.cache.backend,
+            redis_url=settings.cache.redis_url,
+            max_size=settings.cache.max_size,
+            redis_pool_size=settings.cache.redis_pool_size,
+            redis_timeout=settings.cache.redis_timeout,
+        )
+        self._kitten_cache = (
+            EntityCache(backend, "kitten", ttl=settings.cache.ttl, invalidation_hold=settings.cache.invalidation_hold)
+            if backend
+            else None
+        )
+        self._single_flight = SingleFlight()
+        batching = settings.write_batching
+        self._kitten_batcher = (
+            MicroBatcher(self._insert_kittens, batching.max_items, batching.max_delay_ms / 1000)
+            if batching.enabled else None
+        )
+        self.changes = ChangeFeed(settings.changes.replay_size, settings.changes.buffer_size)
+
+    @property
+    def db(self) -> Database:
+        if self._db is None:
+            postgres = self._settings.postgres
+            self._db = Database(
+                str(postgres.url),
+                replica_urls=[str(url) for url in postgres.replica_urls],
+                replica_strategy=postgres.replica_strategy,
+                echo=postgres.echo,
+                query_log=QueryLog(self._settings.query_log),
+                pool=postgres.pool,
+            )
+        return self._db
+
+    def use_database(self, db: Optional[Database]) -> None:
+        # Подмена базы для тестов и нагрузочных прогонов; None — снова база из настроек
+        self._db = db
+
+    async def startup(self) -> None:
+        pool = self._settings.postgres.pool
+        # Соединения сверх size — переполнение, пул закрывает их при возврате, греть их незачем
+        await self.db.prewarm(min(pool.prewarm, pool.size))
+        if self._settings.changes.bridge and self.db.engine.dialect.name == "postgresql":
+            changes = self._settings.changes
+            bridge = PostgresBridge(self.changes, self.db.engine, changes.channel, changes.reorder_window)
+            await bridge.start()
+            self.changes.bridge = bridge
+        # Каталог пород загружаем до готовности, чтобы первые запросы не ждали базу
+        async with self.unit_of_work() as uow:
+            await self._breed_service(uow).get_breeds_catalogue()
+
+    async def shutdown(self) -> None:
+        if self.changes.bridge is not None:
+            await self.changes.bridge.stop()
+            self.changes.bridge = None
+        if self._db is not None:
+            await self._db.dispose()
+            self._db = None
+
+    def unit_of_work(self) -> UnitOfWork:
+        return self.db.unit_of_work()
+
+    async def _insert_kittens(self, kittens: List[KittenCreate]) -> List[KittenBulkResult]:
+        # Неизвестная порода даёт ошибку только своей записи, остальные вставляются.
+        # События публикуются после коммита самой пачки, а не запросов, которые её дождались
+        async with self.unit_of_work() as uow:
+            service = KittenService(KittenRepository(uow.session), unit_of_work=uow, changes=self.changes)
+            return await service.create_kittens(kittens)
+
+    def _breed_service(self, uow: UnitOfWork) -> BreedService:
+        repository = BreedRepository(uow.session, uow.read_session, uow.detached_session)
+        return BreedService(repository, self._breed_cache, self._single_flight)
+
+    async def create_kitten_service(self, uow: UnitOfWork = Depends(get_unit_of_work)) -> KittenService:
+            repository = KittenRepository(uow.session, uow.read_session, uow.detached_session)
+            return KittenService(
+                repository, cache=self._kitten_cache, unit_of_work=uow, single_flight=self._single_flight,
+                batcher=self._kitten_batcher, changes=self.changes,
+            )
 
-    async def create_kitten_service(self) -> KittenService:
-            repository = KittenRepository(self._db.session)
-            return KittenService(repository)
+    def get_change_feed(self) -> ChangeFeed:
+        return self.changes
 
-    async def create_breed_service(self) -> BreedService:
-            repository = BreedRepository(self._db.session)
-            return BreedService(repository)
+    async def create_breed_service(self, uow: UnitOfWork = Depends(get_unit_of_work)) -> BreedService:
+            return self._breed_service(uow)
 
 
 service_factory = ServiceFactory()
@@ -0,0 +1,216 @@
+import time
+import weakref
+from bisect import bisect_left
+from contextvars import ContextVar
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Метрики обновляются только из потока event loop (события SQLAlchemy при async-драйверах
+# тоже вызываются в нём), поэтому обходимся без блокировок: запись — это пара операций со словарём
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # На каждый набор меток: счётчики по корзинам (последняя — +Inf), сумма и количество
+        self._series: Dict[Labels, List] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def collect(self) -> Iterable[str]:
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str], collector: Callable[[], Iterable[Tuple[Labels, float]]]
+    ):
+        # Значения снимаются в момент опроса, а не поддерживаются на горячем пути
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collector = collector
+
+    def collect(self) -> Iterable[str]:
+        for labels, value in self.collector():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Скоуп текущего HTTP-запроса: к моменту выполнения SQL роутер уже положил в него шаблон пути
+_current_scope: ContextVar[Optional[dict]] = ContextVar("metrics_scope", default=None)
+# Суммарное ожидание соединений из пула в рамках текущего запроса (для контроля допуска).
+# Список, а не число: выдача соединения идёт в гринлете с копией контекста
+_pool_wait: ContextVar[Optional[List[float]]] = ContextVar("pool_wait", default=None)
+_engines: "weakref.WeakValueDictionary[str, AsyncEngine]" = weakref.WeakValueDictionary()
+
+
+def route_template(scope: Optional[dict]) -> str:
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def current_route() -> str:
+    return route_template(_current_scope.get())
+
+
+@contextmanager
+def measure_pool_wait() -> Iterator[List[float]]:
+    waited = [0.0]
+    token = _pool_wait.set(waited)
+    try:
+        yield waited
+    finally:
+        _pool_wait.reset(token)
+
+
+def _pool_stats() -> Iterable[Tuple[Labels, float]]:
+    for name, engine in list(_engines.items()):
+        pool = engine.sync_engine.pool
+        for stat in ("size", "checkedout", "overflow"):
+            method = getattr(pool, stat, None)
+            if method is not None:
+                yield (name, stat), method()
+
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+))
+DB_QUERY_DURATION = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ("engine", "route", "statement")
+))
+DB_POOL_CHECKOUT_DURATION = registry.register(Histogram(
+    "db_pool_checkout_duration_seconds", "Time spent waiting for a pooled connection", ("engine",)
+))
+DB_POOL_CONNECTIONS = registry.register(Gauge(
+    "db_pool_connections", "Connection pool state: size, checked out and overflow connections",
+    ("engine", "state"), _pool_stats,
+))
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    sync_engine = engine.sync_engine
+    _engines[name] = engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+        DB_QUERY_DURATION.observe((name, current_route(), kind), elapsed)
+
+    # У пула нет события «начали ждать соединение», поэтому подменяем класс пула наследником
+    # с замером выдачи. dispose() пересоздаёт пул через self.__class__, и замер переживает его
+    sync_engine.pool.__class__ = _timed_pool_class(type(sync_engine.pool), name)
+
+
+def _timed_pool_class(pool_class: type, name: str) -> type:
+    base = getattr(pool_class, "_metrics_base", pool_class)
+
+    class TimedPool(base):
+        _metrics_base = base
+
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                elapsed = time.perf_counter() - started
+                DB_POOL_CHECKOUT_DURATION.observe((name,), elapsed)
+                waited = _pool_wait.get()
+                if waited is not None:
+                    waited[0] += elapsed
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+class MetricsMiddleware:
+    # Чистый ASGI-middleware: без BaseHTTPMiddleware и лишней задачи на каждый запрос
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_scope.reset(token)
+            HTTP_REQUEST_DURATION.observe(
+                (scope["method"], route_template(scope), str(status)), time.perf_counter() - started
+            )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import DDL, Column, Integer, String, ForeignKey, Index, Sequence, event
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 
 from src.database import Base
@@ -13,9 +13,123 @@ class Breed(Base):
 
 class Kitten(Base):
     __tablename__ = 'kittens'
+    # Индексы под фильтры и сортировки GET /kittens/: id в конце служит ключом курсора
+    __table_args__ = (
+        Index('ix_kittens_breed_id_id', 'breed_id', 'id'),
+        Index('ix_kittens_breed_id_age_id', 'breed_id', 'age', 'id'),
+        Index('ix_kittens_age_id', 'age', 'id'),
+        Index('ix_kittens_color_id', 'color', 'id'),
+        Index('ix_kittens_color_age_id', 'color', 'age', 'id'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     color: Mapped[str] = mapped_column(String)
     age: Mapped[int] = mapped_column(Integer)
     description: Mapped[str] = mapped_column(String)
     breed_id: Mapped[int] = mapped_column(Integer, ForeignKey('breeds.id'))
     breed = relationship("Breed", back_populates="kittens")
+
+
+# Полнотекстовый поиск по описанию живёт вне ORM-модели: в PostgreSQL это генерируемая
+# колонка tsvector с GIN-индексом, в SQLite — внешняя FTS5-таблица, синхронизируемая триггерами
+SEARCH_CONFIG = 'simple'
+SEARCH_INDEX_DDL = "CREATE INDEX ix_kittens_search_vector ON kittens USING gin (search_vector)"
+
+for statement in (
+    f"ALTER TABLE kittens ADD COLUMN search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(description, ''))) STORED",
+    SEARCH_INDEX_DDL,
+):
+    event.listen(Kitten.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+for statement in (
+    "CREATE VIRTUAL TABLE kittens_fts USING fts5(description, content='kittens', content_rowid='id')",
+    "CREATE TRIGGER kittens_fts_ai AFTER INSERT ON kittens BEGIN "
+    "INSERT INTO kittens_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER kittens_fts_ad AFTER DELETE ON kittens BEGIN "
+    "INSERT INTO kittens_fts(kittens_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER kittens_fts_au AFTER UPDATE OF description ON kittens BEGIN "
+    "INSERT INTO kittens_fts(kittens_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+    "INSERT INTO kittens_fts(rowid, description) VALUES (new.id, new.description); END",
+):
+    event.listen(Kitten.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Kitten.__table__, "before_drop", DDL("DROP TABLE IF EXISTS kittens_fts").execute_if(dialect="sqlite"))
+
+
+class BreedAgeStat(Base):
+    __tablename__ = 'breed_age_stats'
+    breed_id: Mapped[int] = mapped_column(Integer, ForeignKey('breeds.id', ondelete='CASCADE'), primary_key=True)
+    age: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class BreedColorStat(Base):
+    __tablename__ = 'breed_color_stats'
+    breed_id: Mapped[int] = mapped_column(Integer, ForeignKey('breeds.id', ondelete='CASCADE'), primary_key=True)
+    color: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+# Сводка по породам хранит гистограммы возрастов и цветов, поэтому count, min, avg и max
+# считаются по нескольким строкам на породу, а не по всем котятам. Счётчики обновляются
+# триггерами в той же транзакции, что и запись в kittens: так их не обходит ни один путь
+# записи репозитория, включая COPY и массовые UPDATE. Строки с нулевым счётчиком остаются
+# до пересборки и при чтении отфильтровываются
+BREED_STATS_POSTGRES_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION kittens_breed_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE breed_age_stats s SET count = s.count - d.n
+            FROM (SELECT breed_id, age, count(*) AS n FROM old_rows GROUP BY breed_id, age) d
+            WHERE s.breed_id = d.breed_id AND s.age = d.age;
+            UPDATE breed_color_stats s SET count = s.count - d.n
+            FROM (SELECT breed_id, color, count(*) AS n FROM old_rows GROUP BY breed_id, color) d
+            WHERE s.breed_id = d.breed_id AND s.color = d.color;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO breed_age_stats (breed_id, age, count)
+            SELECT breed_id, age, count(*) FROM new_rows GROUP BY breed_id, age
+            ON CONFLICT (breed_id, age) DO UPDATE SET count = breed_age_stats.count + excluded.count;
+            INSERT INTO breed_color_stats (breed_id, color, count)
+            SELECT breed_id, color, count(*) FROM new_rows GROUP BY breed_id, color
+            ON CONFLICT (breed_id, color) DO UPDATE SET count = breed_color_stats.count + excluded.count;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER kittens_breed_stats_ai AFTER INSERT ON kittens "
+    "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION kittens_breed_stats()",
+    "CREATE TRIGGER kittens_breed_stats_au AFTER UPDATE ON kittens "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION kittens_breed_stats()",
+    "CREATE TRIGGER kittens_breed_stats_ad AFTER DELETE ON kittens "
+    "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION kittens_breed_stats()",
+)
+
+BREED_STATS_SQLITE_DDL = (
+    "CREATE TRIGGER kittens_breed_stats_ai AFTER INSERT ON kittens BEGIN "
+    "INSERT INTO breed_age_stats (breed_id, age, count) VALUES (new.breed_id, new.age, 1) "
+    "ON CONFLICT (breed_id, age) DO UPDATE SET count = count + 1; "
+    "INSERT INTO breed_color_stats (breed_id, color, count) VALUES (new.breed_id, new.color, 1) "
+    "ON CONFLICT (breed_id, color) DO UPDATE SET count = count + 1; END",
+    "CREATE TRIGGER kittens_breed_stats_ad AFTER DELETE ON kittens BEGIN "
+    "UPDATE breed_age_stats SET count = count - 1 WHERE breed_id = old.breed_id AND age = old.age; "
+    "UPDATE breed_color_stats SET count = count - 1 WHERE breed_id = old.breed_id AND color = old.color; END",
+    "CREATE TRIGGER kittens_breed_stats_au AFTER UPDATE OF breed_id, age, color ON kittens BEGIN "
+    "UPDATE breed_age_stats SET count = count - 1 WHERE breed_id = old.breed_id AND age = old.age; "
+    "UPDATE breed_color_stats SET count = count - 1 WHERE breed_id = old.breed_id AND color = old.color; "
+    "INSERT INTO breed_age_stats (breed_id, age, count) VALUES (new.breed_id, new.age, 1) "
+    "ON CONFLICT (breed_id, age) DO UPDATE SET count = count + 1; "
+    "INSERT INTO breed_color_stats (breed_id, color, count) VALUES (new.breed_id, new.color, 1) "
+    "ON CONFLICT (breed_id, color) DO UPDATE SET count = count + 1; END",
+)
+
+# Триггеры ссылаются на таблицы сводки, поэтому создаются после всей схемы
+for statement in BREED_STATS_POSTGRES_DDL:
+    event.listen(Base.metadata, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in BREED_STATS_SQLITE_DDL:
+    event.listen(Base.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+
+# Номера событий ленты изменений котят общие для всех воркеров: их выдаёт последовательность PostgreSQL
+kitten_changes_id_seq = Sequence('kitten_changes_id_seq', metadata=Base.metadata)
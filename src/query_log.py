@@ -0,0 +1,157 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.metrics import current_route
+from src.settings import QueryLogSettings
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых медленных запросов и повторяющихся выражений попадает в запись лога
+REPORT_LIMIT = 5
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, record: Dict[str, Any]):
+        super().__init__(json.dumps(record, ensure_ascii=False))
+        self.record = record
+
+
+@dataclass
+class _Statement:
+    sql: str
+    params: Any
+    elapsed: float
+
+
+@dataclass
+class QueryAudit:
+    statements: List[_Statement] = field(default_factory=list)
+    # Для каждого текста SQL — отпечатки различных наборов параметров, с которыми он выполнялся
+    variants: Dict[str, Set[int]] = field(default_factory=dict)
+
+    def record(self, sql: str, parameters: Any, executemany: bool, elapsed: float) -> None:
+        self.statements.append(_Statement(sql, parameters_shape(parameters, executemany), elapsed))
+        self.variants.setdefault(sql, set()).add(parameters_fingerprint(parameters, executemany))
+
+
+def parameters_fingerprint(parameters: Any, executemany: bool = False) -> int:
+    # Для поиска N+1 хватает хэша: значения параметров не хранятся и не копируются в строку.
+    # executemany — одна пачка, а не повтор, её отличаем только по числу строк
+    if executemany and isinstance(parameters, (list, tuple)):
+        return hash(("executemany", len(parameters)))
+    if isinstance(parameters, dict):
+        parameters = tuple(parameters.items())
+    try:
+        return hash(parameters)
+    except TypeError:
+        # Списки (например, массив для = ANY) не хэшируются: берём хэш от их представления
+        return hash(repr(parameters))
+
+
+def parameters_shape(parameters: Any, executemany: bool = False) -> Any:
+    # В лог попадают только имена и типы параметров, не значения
+    if executemany and isinstance(parameters, (list, tuple)):
+        return {"rows": len(parameters), "row": parameters_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+_current_audit: ContextVar[Optional[QueryAudit]] = ContextVar("query_audit", default=None)
+
+
+def attach(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+    if event.contains(sync_engine, "after_cursor_execute", _after_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_audit.get() is not None:
+        context._query_log_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    audit = _current_audit.get()
+    started = getattr(context, "_query_log_started", None)
+    if audit is not None and started is not None:
+        audit.record(statement, parameters, executemany, time.perf_counter() - started)
+
+
+class QueryLog:
+    def __init__(self, settings: Optional[QueryLogSettings] = None):
+        self.settings = settings or QueryLogSettings()
+
+    def begin(self) -> Optional[Token]:
+        # Вложенные сессии и единицы работы пишут в учёт внешней
+        if not self.settings.enabled or _current_audit.get() is not None:
+            return None
+        return _current_audit.set(QueryAudit())
+
+    def end(self, token: Optional[Token], raise_errors: bool = True) -> None:
+        if token is None:
+            return
+        audit = _current_audit.get()
+        _current_audit.reset(token)
+        record = self.check(audit)
+        if record is None:
+            return
+        logger.warning("Query budget exceeded: %s", json.dumps(record, ensure_ascii=False), extra={"query_log": record})
+        if self.settings.strict and raise_errors:
+            raise QueryBudgetExceeded(record)
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        token = self.begin()
+        try:
+            yield
+        except BaseException:
+            self.end(token, raise_errors=False)
+            raise
+        self.end(token)
+
+    def check(self, audit: QueryAudit) -> Optional[Dict[str, Any]]:
+        settings = self.settings
+        total = sum(statement.elapsed for statement in audit.statements)
+        slow = [s for s in audit.statements if s.elapsed * 1000 >= settings.slow_query_ms]
+        repeated = {
+            sql: len(variants) for sql, variants in audit.variants.items()
+            if len(variants) >= settings.repeated_statements
+        }
+        violations = []
+        if slow:
+            violations.append("slow_query")
+        if total * 1000 >= settings.request_sql_ms:
+            violations.append("request_sql_time")
+        if len(audit.statements) > settings.max_statements:
+            violations.append("statement_count")
+        if repeated:
+            violations.append("repeated_statement")
+        if not violations:
+            return None
+        slowest = sorted(audit.statements, key=lambda s: s.elapsed, reverse=True)[:REPORT_LIMIT]
+        return {
+            "route": current_route(),
+            "violations": violations,
+            "statements": len(audit.statements),
+            "total_sql_ms": round(total * 1000, 3),
+            "slowest": [
+                {"sql": s.sql, "params": s.params, "ms": round(s.elapsed * 1000, 3)} for s in slowest
+            ],
+            "repeated": [
+                {"sql": sql, "distinct_params": count}
+                for sql, count in sorted(repeated.items(), key=lambda item: -item[1])[:REPORT_LIMIT]
+            ],
+        }
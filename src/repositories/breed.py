@@ -1,23 +1,98 @@
 from contextlib import AbstractContextManager
-from typing import Callable
+from typing import Callable, Dict, List, Optional
 
-from sqlalchemy import select
+from sqlalchemy import and_, delete, func, insert, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src.models import Kitten, Breed
-from src.schemas.breed import BreedView
+from src.models import Kitten, Breed, BreedAgeStat, BreedColorStat
+from src.schemas.breed import BreedStats, BreedView
 from src.schemas.kitten import KittenView, KittenCreate
 
 
 class BreedRepository:
-    def __init__(self, session_factory: Callable[..., AbstractContextManager[Session]]):
+    def __init__(
+        self,
+        session_factory: Callable[..., AbstractContextManager[Session]],
+        read_session_factory: Optional[Callable[..., AbstractContextManager[Session]]] = None,
+        detached_session_factory: Optional[Callable[..., AbstractContextManager[Session]]] = None,
+    ):
         self.session_factory = session_factory
+        self.read_session_factory = read_session_factory or session_factory
+        self.detached_session_factory = detached_session_factory or self.read_session_factory
         self.view_model = BreedView
         self.model = Breed
 
+    def detached(self) -> "BreedRepository":
+        return BreedRepository(
+            self.detached_session_factory, self.detached_session_factory, self.detached_session_factory
+        )
+
     async def get_all_breeds(self) -> BreedView:
-        async with self.session_factory() as session:
+        async with self.read_session_factory() as session:
             query = select(self.model)
             result = await session.execute(query)
             return result.scalars().all()
+
+    async def get_breed_stats(self) -> List[BreedStats]:
+        # Читаются только гистограммы: стоимость зависит от числа пород, возрастов и цветов,
+        # но не от числа котят
+        ages = (
+            select(
+                Breed.id,
+                Breed.name,
+                func.coalesce(func.sum(BreedAgeStat.count), 0).label("count"),
+                func.min(BreedAgeStat.age).label("min_age"),
+                func.max(BreedAgeStat.age).label("max_age"),
+                func.sum(BreedAgeStat.age * BreedAgeStat.count).label("age_total"),
+            )
+            .outerjoin(BreedAgeStat, and_(BreedAgeStat.breed_id == Breed.id, BreedAgeStat.count > 0))
+            .group_by(Breed.id, Breed.name)
+            .order_by(Breed.id)
+        )
+        colors = (
+            select(BreedColorStat.breed_id, BreedColorStat.color, BreedColorStat.count)
+            .where(BreedColorStat.count > 0)
+            .order_by(BreedColorStat.breed_id, BreedColorStat.color)
+        )
+        async with self.read_session_factory() as session:
+            age_rows = (await session.execute(ages)).all()
+            color_rows = (await session.execute(colors)).all()
+        distribution: Dict[int, Dict[str, int]] = {}
+        for breed_id, color, count in color_rows:
+            distribution.setdefault(breed_id, {})[color] = count
+        return [
+            BreedStats(
+                id=row.id,
+                name=row.name,
+                count=row.count,
+                min_age=row.min_age,
+                avg_age=row.age_total / row.count if row.count else None,
+                max_age=row.max_age,
+                colors=distribution.get(row.id, {}),
+            )
+            for row in age_rows
+        ]
+
+    async def rebuild_breed_stats(self) -> None:
+        async with self.session_factory() as session:
+            connection = await session.connection()
+            if connection.dialect.name == "postgresql":
+                # Не даём записям в kittens разойтись с пересчитанной сводкой
+                await session.execute(text("LOCK TABLE kittens IN SHARE MODE"))
+            await session.execute(delete(BreedAgeStat))
+            await session.execute(delete(BreedColorStat))
+            await session.execute(
+                insert(BreedAgeStat).from_select(
+                    ["breed_id", "age", "count"],
+                    select(Kitten.breed_id, Kitten.age, func.count())
+                    .group_by(Kitten.breed_id, Kitten.age),
+                )
+            )
+            await session.execute(
+                insert(BreedColorStat).from_select(
+                    ["breed_id", "color", "count"],
+                    select(Kitten.breed_id, Kitten.color, func.count())
+                    .group_by(Kitten.breed_id, Kitten.color),
+                )
+            )
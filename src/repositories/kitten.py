@@ -1,74 +1,336 @@
 from contextlib import AbstractContextManager
-from typing import Callable, List
+import re
+from itertools import groupby
+from typing import AsyncIterator, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
 
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (
+    Integer, Row, and_, any_, bindparam, column, delete, func, insert, literal_column, or_, select, table, text,
+    tuple_, update, values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
 from sqlalchemy.orm import Session, joinedload
 
-from src.models import Kitten
-from src.schemas.kitten import KittenView, KittenCreate, KittenUpdate, KittenPatch
+from src.models import Kitten, Breed, SEARCH_CONFIG
+from src.schemas.kitten import (
+    KittenCreate, KittenUpdate, KittenPatch, KittenBulkPatch, KittenFilter, KITTEN_FIELDS,
+)
+
+
+BULK_CHUNK_SIZE = 1000
 
 
 class KittenRepository:
-    def __init__(self, session_factory: Callable[..., AbstractContextManager[Session]]):
+    def __init__(
+        self,
+        session_factory: Callable[..., AbstractContextManager[Session]],
+        read_session_factory: Optional[Callable[..., AbstractContextManager[Session]]] = None,
+        detached_session_factory: Optional[Callable[..., AbstractContextManager[Session]]] = None,
+    ):
         self.session_factory = session_factory
+        self.read_session_factory = read_session_factory or session_factory
+        self.detached_session_factory = detached_session_factory or self.read_session_factory
         self.model = Kitten
         self.base_stmt = select(Kitten).options(joinedload(self.model.breed))
+        # Имя породы берётся коррелированным подзапросом прямо в RETURNING,
+        # поэтому запись и чтение результата укладываются в один запрос
+        breed_name = (
+            select(Breed.name)
+            .where(Breed.id == self.model.breed_id)
+            .correlate(self.model)
+            .scalar_subquery()
+            .label("breed_name")
+        )
+        self.view_columns = (
+            self.model.id, self.model.color, self.model.age, self.model.description, self.model.breed_id, breed_name,
+        )
+        self.row_stmt = (
+            select(
+                self.model.id, self.model.color, self.model.age, self.model.description, self.model.breed_id,
+                Breed.name.label("breed_name"),
+            )
+            .join(Breed, self.model.breed_id == Breed.id)
+        )
 
-    async def get_all_kittens(self, bread_id: int) -> List[Kitten]:
-        async with self.session_factory() as session:
-            stmt = self.base_stmt
-            if bread_id:
-                stmt = stmt.filter(self.model.breed_id == bread_id)
+    def detached(self) -> "KittenRepository":
+        return KittenRepository(
+            self.detached_session_factory, self.detached_session_factory, self.detached_session_factory
+        )
+
+    def _fields_stmt(self, fields: Optional[FrozenSet[str]], filters: Optional[KittenFilter] = None):
+        if fields is None:
+            return self.row_stmt
+        names = [name for name in KITTEN_FIELDS if name in fields]
+        # Ключи сортировки нужны для курсора, breed_id — для breed.id: берём его из kittens без join
+        for name, _ in (filters or KittenFilter()).sort_columns:
+            if name not in names:
+                names.append(name)
+        if "breed.id" in fields and "breed_id" not in names:
+            names.append("breed_id")
+        stmt = select(*(getattr(self.model, name) for name in names))
+        if "breed.name" in fields:
+            stmt = stmt.add_columns(Breed.name.label("breed_name")).join(Breed, self.model.breed_id == Breed.id)
+        return stmt
+
+    def _page(self, stmt, filters: Optional[KittenFilter], limit: Optional[int], after: Optional[tuple]):
+        filters = filters or KittenFilter()
+        if filters.breed_ids:
+            stmt = stmt.filter(self.model.breed_id.in_(filters.breed_ids))
+        if filters.age_min is not None:
+            stmt = stmt.filter(self.model.age >= filters.age_min)
+        if filters.age_max is not None:
+            stmt = stmt.filter(self.model.age <= filters.age_max)
+        if filters.colors:
+            stmt = stmt.filter(self.model.color.in_(filters.colors))
+        order = [(getattr(self.model, name), desc) for name, desc in filters.sort_columns]
+        if after is not None:
+            stmt = stmt.filter(self._keyset(order, after))
+        stmt = stmt.order_by(*(column.desc() if desc else column.asc() for column, desc in order))
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
+
+    @staticmethod
+    def _keyset(order, after: tuple):
+        directions = {desc for _, desc in order}
+        if len(directions) == 1:
+            # Одно направление: сравнение кортежей, которое индекс отрабатывает одним диапазоном
+            left = tuple_(*(column for column, _ in order))
+            right = tuple_(*after)
+            return left < right if directions.pop() else left > right
+        clauses = []
+        for index, (column, desc) in enumerate(order):
+            equal = [order[prev][0] == after[prev] for prev in range(index)]
+            clauses.append(and_(*equal, column < after[index] if desc else column > after[index]))
+        # Нестрогая граница по первому ключу отдельно: по ней индекс читается диапазоном, а не целиком
+        first, desc = order[0]
+        return and_(first <= after[0] if desc else first >= after[0], or_(*clauses))
+
+    async def get_all_kittens(
+        self, filters: Optional[KittenFilter] = None, limit: Optional[int] = None, after: Optional[tuple] = None
+    ) -> List[Kitten]:
+        async with self.read_session_factory() as session:
+            stmt = self._page(self.base_stmt, filters, limit, after)
             result = await session.execute(stmt)
             items = result.scalars().all()
             return items
 
+    async def get_kitten_rows(
+        self,
+        filters: Optional[KittenFilter] = None,
+        limit: Optional[int] = None,
+        after: Optional[tuple] = None,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Sequence[Row]:
+        async with self.read_session_factory() as session:
+            stmt = self._page(self._fields_stmt(fields, filters), filters, limit, after)
+            result = await session.execute(stmt)
+            return result.all()
+
+    async def get_kitten_row(self, kitten_id: int, fields: Optional[FrozenSet[str]] = None) -> Optional[Row]:
+        async with self.read_session_factory() as session:
+            result = await session.execute(self._fields_stmt(fields).where(self.model.id == kitten_id))
+            return result.one_or_none()
+
+    async def search_kittens(
+        self, query: str, bread_id: Optional[int] = None, limit: int = 20, after: Optional[tuple] = None
+    ) -> Sequence[Row]:
+        async with self.read_session_factory() as session:
+            connection = await session.connection()
+            if connection.dialect.name == "postgresql":
+                tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query)
+                vector = literal_column("kittens.search_vector")
+                rank = func.ts_rank(vector, tsquery)
+                stmt = self.row_stmt.where(vector.op("@@")(tsquery))
+                descending = True
+            else:
+                # Пользовательский ввод не должен попадать в синтаксис FTS5: каждое слово берём в кавычки
+                terms = re.findall(r"\w+", query)
+                if not terms:
+                    return []
+                fts = table("kittens_fts", column("rowid"))
+                rank = func.bm25(literal_column("kittens_fts"))
+                stmt = (
+                    self.row_stmt
+                    .join(fts, fts.c.rowid == self.model.id)
+                    .where(literal_column("kittens_fts").op("MATCH")(" ".join(f'"{term}"' for term in terms)))
+                )
+                # bm25 возвращает меньшие значения для более релевантных строк
+                descending = False
+            order = [(rank, descending), (self.model.id, descending)]
+            stmt = stmt.add_columns(rank.label("rank"))
+            if bread_id:
+                stmt = stmt.filter(self.model.breed_id == bread_id)
+            if after is not None:
+                stmt = stmt.filter(self._keyset(order, after))
+            stmt = stmt.order_by(*(key.desc() if desc else key.asc() for key, desc in order)).limit(limit)
+            result = await session.execute(stmt)
+            return result.all()
+
+    async def stream_kittens(
+        self, filters: Optional[KittenFilter] = None, chunk_size: int = 1000
+    ) -> AsyncIterator[Sequence[Row]]:
+        async with self.detached_session_factory() as session:
+            stmt = self._page(self.row_stmt, filters, None, None).execution_options(yield_per=chunk_size)
+            result = await session.stream(stmt)
+            async for partition in result.partitions():
+                yield partition
+
     async def get_kitten_by_id(self, kitten_id: int):
-        async with self.session_factory() as session:
+        async with self.read_session_factory() as session:
             query = self.base_stmt.where(Kitten.id == kitten_id)
             result = await session.execute(query)
             return result.scalar_one_or_none()
 
     async def add_kitten(self, kitten_data: KittenCreate):
         async with self.session_factory() as session:
-            async with session.begin():
-                kitten = self.model(**kitten_data.model_dump())
-                session.add(kitten)
-                await session.commit()
+            kitten = self.model(**kitten_data.model_dump())
+            session.add(kitten)
+            await session.flush()
             await session.refresh(kitten, attribute_names=['breed'])
             return kitten
 
-    async def update_kitten(self, kitten_id: int, kitten_data: KittenUpdate):
+    async def add_kittens(self, kittens_data: List[KittenCreate]) -> List[Optional[dict]]:
         async with self.session_factory() as session:
-            async with session.begin():
-                kitten = await session.get(self.model, kitten_id)
-                if not kitten:
-                    return None
-                for key, value in kitten_data.model_dump().items():
-                    setattr(kitten, key, value)
-                await session.commit()
-            await session.refresh(kitten, attribute_names=['breed'])
-            return kitten
+            breed_ids = {kitten.breed_id for kitten in kittens_data}
+            result = await session.execute(select(Breed.id, Breed.name).where(Breed.id.in_(breed_ids)))
+            breeds = {row.id: row.name for row in result}
+            values = [kitten.model_dump() for kitten in kittens_data if kitten.breed_id in breeds]
+            if values:
+                connection = await session.connection()
+                if connection.dialect.name == "postgresql":
+                    ids = await self._copy_kittens(connection, values)
+                else:
+                    ids = await self._insert_kittens(session, values)
+                for item, kitten_id in zip(values, ids):
+                    item["id"] = kitten_id
+                    item["breed"] = {"id": item["breed_id"], "name": breeds[item["breed_id"]]}
+            created = iter(values)
+            return [next(created) if kitten.breed_id in breeds else None for kitten in kittens_data]
 
-    async def patch_kitten(self, kitten_id: int, kitten_data: KittenPatch):
-        async with self.session_factory() as session:
-            async with session.begin():
-                kitten = await session.get(self.model, kitten_id)
-                if not kitten:
-                    return None
-                for key, value in kitten_data.model_dump(exclude_unset=True).items():
-                    setattr(kitten, key, value)
-                await session.commit()
-            await session.refresh(kitten, attribute_names=['breed'])
-            return kitten
+    async def _insert_kittens(self, session: AsyncSession, values: List[dict]) -> List[int]:
+        # Многострочный INSERT ... VALUES на пачку: executemany с RETURNING в SQLite
+        # выполняется построчно. Новые id растут в порядке строк VALUES, а порядок
+        # строк RETURNING не гарантирован, поэтому сопоставляем по отсортированным id
+        ids: List[int] = []
+        for start in range(0, len(values), BULK_CHUNK_SIZE):
+            stmt = insert(self.model).values(values[start:start + BULK_CHUNK_SIZE]).returning(self.model.id)
+            ids.extend(sorted((await session.execute(stmt)).scalars().all()))
+        return ids
+
+    async def _copy_kittens(self, connection: AsyncConnection, values: List[dict]) -> List[int]:
+        # COPY не умеет RETURNING, поэтому id резервируются в последовательности заранее
+        result = await connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence('kittens', 'id')) FROM generate_series(1, :n)"),
+            {"n": len(values)},
+        )
+        ids = result.scalars().all()
+        columns = ["id", "color", "age", "description", "breed_id"]
+        records = [
+            (kitten_id, item["color"], item["age"], item["description"], item["breed_id"])
+            for kitten_id, item in zip(ids, values)
+        ]
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            self.model.__tablename__, records=records, columns=columns
+        )
+        return ids
+
+    async def update_kitten(self, kitten_id: int, kitten_data: KittenUpdate) -> Optional[dict]:
+        return await self._update_returning(kitten_id, kitten_data.model_dump())
+
+    async def patch_kitten(self, kitten_id: int, kitten_data: KittenPatch) -> Optional[dict]:
+        return await self._update_returning(kitten_id, kitten_data.model_dump(exclude_unset=True))
 
     async def delete_kitten(self, kitten_id: int) -> bool:
         async with self.session_factory() as session:
-            async with session.begin():
-                kitten = await session.get(self.model, kitten_id)
-                if not kitten:
-                    return False
-                await session.delete(kitten)
-                await session.commit()
-            return True
+            stmt = delete(self.model).where(self.model.id == kitten_id).returning(self.model.id)
+            deleted = (await session.execute(stmt)).scalar_one_or_none()
+            return deleted is not None
+
+    async def _update_returning(self, kitten_id: int, changes: dict) -> Optional[dict]:
+        async with self.session_factory() as session:
+            if changes:
+                stmt = (
+                    update(self.model)
+                    .where(self.model.id == kitten_id)
+                    .values(changes)
+                    .returning(*self.view_columns)
+                    .execution_options(synchronize_session=False)
+                )
+            else:
+                stmt = select(*self.view_columns).where(self.model.id == kitten_id)
+            row = (await session.execute(stmt)).one_or_none()
+            return self._row_to_dict(row) if row is not None else None
+
+    @staticmethod
+    def _row_to_dict(row: Row) -> dict:
+        item = row._asdict()
+        item["breed"] = {"id": item["breed_id"], "name": item.pop("breed_name")}
+        return item
+
+    async def patch_kittens(self, patches: List[KittenBulkPatch]) -> Tuple[List[int], List[int]]:
+        changes: Dict[int, dict] = {}
+        for patch in patches:
+            changes.setdefault(patch.id, {}).update(patch.model_dump(exclude_unset=True, exclude={"id"}))
+        async with self.session_factory() as session:
+            connection = await session.connection()
+            updated = await self._existing_ids(session, [kitten_id for kitten_id, item in changes.items() if not item])
+            # Строки с одинаковым набором полей обновляются одним statement
+            def fields_of(entry):
+                return tuple(sorted(entry[1]))
+            rows = sorted(((kitten_id, item) for kitten_id, item in changes.items() if item), key=fields_of)
+            for fields, group in groupby(rows, key=fields_of):
+                group = list(group)
+                if connection.dialect.name == "postgresql":
+                    updated.extend(await self._update_from_values(session, fields, group))
+                else:
+                    # SQLite не поддерживает список колонок у VALUES во FROM,
+                    # поэтому найденные одним запросом строки обновляются через executemany
+                    existing = await self._existing_ids(session, [kitten_id for kitten_id, _ in group])
+                    if existing:
+                        await session.execute(
+                            update(self.model), [{"id": kitten_id, **changes[kitten_id]} for kitten_id in existing]
+                        )
+                    updated.extend(existing)
+        found = set(updated)
+        return sorted(found), [kitten_id for kitten_id in changes if kitten_id not in found]
+
+    async def _update_from_values(
+        self, session: AsyncSession, fields: Tuple[str, ...], group: List[Tuple[int, dict]]
+    ) -> List[int]:
+        updated = []
+        for start in range(0, len(group), BULK_CHUNK_SIZE):
+            chunk = group[start:start + BULK_CHUNK_SIZE]
+            source = values(
+                column("id", Integer),
+                *(column(field, self.model.__table__.c[field].type) for field in fields),
+                name="source",
+            ).data([(kitten_id, *(item[field] for field in fields)) for kitten_id, item in chunk])
+            stmt = (
+                update(self.model)
+                .where(self.model.id == source.c.id)
+                .values({field: source.c[field] for field in fields})
+                .returning(self.model.id)
+            )
+            updated.extend((await session.execute(stmt)).scalars().all())
+        return updated
+
+    async def delete_kittens(self, kitten_ids: List[int]) -> Tuple[List[int], List[int]]:
+        async with self.session_factory() as session:
+            connection = await session.connection()
+            stmt = delete(self.model).where(self._ids_clause(connection, kitten_ids)).returning(self.model.id)
+            deleted = set((await session.execute(stmt)).scalars().all())
+        return sorted(deleted), [kitten_id for kitten_id in dict.fromkeys(kitten_ids) if kitten_id not in deleted]
+
+    async def _existing_ids(self, session: AsyncSession, kitten_ids: List[int]) -> List[int]:
+        if not kitten_ids:
+            return []
+        connection = await session.connection()
+        result = await session.execute(select(self.model.id).where(self._ids_clause(connection, kitten_ids)))
+        return result.scalars().all()
+
+    def _ids_clause(self, connection: AsyncConnection, kitten_ids: List[int]):
+        if connection.dialect.name == "postgresql":
+            return self.model.id == any_(bindparam("ids", list(kitten_ids), type_=ARRAY(Integer)))
+        return self.model.id.in_(kitten_ids)
@@ -1,3 +1,5 @@
+from typing import Dict, Optional
+
 from pydantic import BaseModel
 
 
@@ -9,4 +11,12 @@ class BreedView(BreedBase):
     id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class BreedStats(BreedView):
+    count: int
+    min_age: Optional[int] = None
+    avg_age: Optional[float] = None
+    max_age: Optional[int] = None
+    colors: Dict[str, int] = {}
@@ -1,4 +1,9 @@
-from pydantic import BaseModel, Field
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple, Type
+
+from typing_extensions import TypedDict
+
+from pydantic import BaseModel, Field, TypeAdapter, create_model, field_validator, model_validator
 from pydantic.alias_generators import to_camel
 
 from src.schemas.breed import BreedView
@@ -31,6 +36,150 @@ class KittenPatch(KittenBase):
     breed_id: int | None = Field(None)
 
 
+class KittenBulkPatch(KittenPatch):
+    id: int
+
+
 class KittenView(KittenBase):
     id: int
     breed: BreedView
+
+
+SORT_KEYS = ("id", "age", "color")
+# Столбцы индексов kittens (см. src.models) и первичного ключа. Сочетание фильтров и сортировки
+# принимается, если хотя бы один из них сужает выборку или отдаёт строки по первому ключу сортировки
+SORT_INDEXES = (
+    ("id",),
+    ("breed_id", "id"),
+    ("breed_id", "age", "id"),
+    ("age", "id"),
+    ("color", "id"),
+    ("color", "age", "id"),
+)
+
+
+class KittenFilter(BaseModel):
+    breed_ids: Tuple[int, ...] = ()
+    age_min: Optional[int] = None
+    age_max: Optional[int] = None
+    colors: Tuple[str, ...] = ()
+    sort: Tuple[str, ...] = ("id",)
+
+    class Config:
+        frozen = True
+
+    @field_validator("sort", mode="before")
+    @classmethod
+    def parse_sort(cls, value):
+        if isinstance(value, str):
+            value = [part.strip() for part in value.split(",") if part.strip()]
+        keys, names = [], set()
+        for key in value:
+            name = key[1:] if key.startswith("-") else key
+            if name not in SORT_KEYS:
+                raise ValueError(f"Unknown sort key: {name}")
+            if name in names:
+                raise ValueError(f"Duplicate sort key: {name}")
+            keys.append(key)
+            names.add(name)
+            # id уникален, ключи после него порядок уже не меняют
+            if name == "id":
+                break
+        if "id" not in names:
+            # Направление добавленного id совпадает с последним ключом, чтобы индекс читался одним проходом
+            keys.append("-id" if keys and keys[-1].startswith("-") else "id")
+        return tuple(keys)
+
+    @model_validator(mode="after")
+    def check_index(self) -> "KittenFilter":
+        if not any(self._served_by(index) for index in SORT_INDEXES):
+            raise ValueError(
+                "Without a filter the sort keys must come from one index: (id), (age, id) or (color, age, id)"
+            )
+        return self
+
+    def _served_by(self, index: Tuple[str, ...]) -> bool:
+        # Первый столбец индекса под фильтром (равенство, список или диапазон) — индекс сужает выборку.
+        # Индекс начинается с первого ключа сортировки и содержит остальные — строки идут по порядку,
+        # ключи в другом направлении досортировываются внутри групп с одинаковым значением (incremental sort)
+        filtered = {name for name, values in (("breed_id", self.breed_ids), ("color", self.colors)) if values}
+        if self.age_min is not None or self.age_max is not None:
+            filtered.add("age")
+        names = [name for name, _ in self.sort_columns]
+        return index[0] in filtered or (index[0] == names[0] and set(names) <= set(index))
+
+    @property
+    def sort_columns(self) -> Tuple[Tuple[str, bool], ...]:
+        return tuple((key.lstrip("-"), key.startswith("-")) for key in self.sort)
+
+
+class KittenPage(BaseModel):
+    items: List[KittenView]
+    next_cursor: Optional[str] = None
+
+
+class KittenBulkResult(BaseModel):
+    index: int
+    kitten: Optional[KittenView] = None
+    error: Optional[str] = None
+
+
+class KittenBulkOutcome(BaseModel):
+    ids: List[int]
+    missing: List[int]
+
+
+class BreedRow(TypedDict):
+    name: str
+    id: int
+
+
+# Сериализованный по алиасам KittenView для чтения без ORM
+class KittenRow(TypedDict):
+    color: str
+    age: int
+    description: str
+    breedId: int
+    id: int
+    breed: BreedRow
+
+
+KITTEN_FIELDS = ("color", "age", "description", "breed_id", "id")
+BREED_FIELDS = ("name", "id")
+
+
+def parse_kitten_fields(raw: str) -> FrozenSet[str]:
+    fields = set()
+    for name in filter(None, (part.strip() for part in raw.split(","))):
+        if name == "breedId":
+            name = "breed_id"
+        if name == "breed":
+            fields.update(f"breed.{field}" for field in BREED_FIELDS)
+        elif name in KITTEN_FIELDS or (name.startswith("breed.") and name[len("breed."):] in BREED_FIELDS):
+            fields.add(name)
+        else:
+            raise ValueError(f"Unknown field: {name}")
+    if not fields:
+        raise ValueError("No fields requested")
+    return frozenset(fields)
+
+
+@lru_cache(maxsize=256)
+def kitten_view_subset(fields: FrozenSet[str]) -> Type[BaseModel]:
+    definitions = {
+        name: (KittenView.model_fields[name].annotation, ...) for name in KITTEN_FIELDS if name in fields
+    }
+    breed_fields = [name for name in BREED_FIELDS if f"breed.{name}" in fields]
+    if breed_fields:
+        breed_model = create_model(
+            "BreedViewSubset",
+            __config__=BreedView.model_config,
+            **{name: (BreedView.model_fields[name].annotation, ...) for name in breed_fields},
+        )
+        definitions["breed"] = (breed_model, ...)
+    return create_model("KittenViewSubset", __config__=KittenView.model_config, **definitions)
+
+
+@lru_cache(maxsize=256)
+def kitten_subset_adapter(fields: FrozenSet[str]) -> TypeAdapter:
+    return TypeAdapter(List[kitten_view_subset(fields)])
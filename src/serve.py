@@ -0,0 +1,217 @@
+import argparse
+import logging
+import logging.config
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import uvicorn
+
+from src.settings import ServeSettings, Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+APP = "src.application:app"
+RESPAWN_BACKOFF = 1.0
+
+
+def cpu_count() -> int:
+    # Учитываем ограничение по ядрам для процесса (taskset, cgroups в контейнере)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@dataclass
+class ServeOptions:
+    profile: str
+    host: str
+    port: int
+    workers: int
+    max_requests: int
+    max_requests_jitter: int
+    log_config: Optional[str]
+
+    @property
+    def reload(self) -> bool:
+        return self.profile == "dev"
+
+
+def resolve_options(settings: ServeSettings, args: argparse.Namespace) -> ServeOptions:
+    profile = args.profile or settings.profile
+    workers = args.workers or settings.workers or cpu_count()
+    return ServeOptions(
+        profile=profile,
+        host=args.host or settings.host,
+        port=args.port or settings.port,
+        # В dev один процесс с перезагрузкой по изменению файлов
+        workers=1 if profile == "dev" else workers,
+        max_requests=args.max_requests if args.max_requests is not None else settings.max_requests,
+        max_requests_jitter=settings.max_requests_jitter,
+        log_config=settings.log_config,
+    )
+
+
+def connections_per_worker(settings: Settings) -> int:
+    # Весь пул с переполнением и отдельное соединение слушателя ленты изменений
+    pool = settings.postgres.pool
+    return pool.size + pool.max_overflow + int(settings.changes.bridge)
+
+
+def fit_pool(settings: Settings, options: ServeOptions) -> None:
+    # Пул по умолчанию рассчитан на один процесс. Если размер не задан явно, делим лимит
+    # соединений сервера между воркерами; переменные окружения — для воркеров, запущенных заново
+    pool = settings.postgres.pool
+    if options.workers == 1 or pool.model_fields_set & {"size", "max_overflow"}:
+        return
+    budget = settings.postgres.max_connections // options.workers - int(settings.changes.bridge)
+    if pool.size + pool.max_overflow <= budget:
+        return
+    pool.size = max(1, budget // 2)
+    pool.max_overflow = max(0, budget - pool.size)
+    os.environ["POSTGRES__POOL__SIZE"] = str(pool.size)
+    os.environ["POSTGRES__POOL__MAX_OVERFLOW"] = str(pool.max_overflow)
+    logger.info("Database pool lowered to %d+%d per worker", pool.size, pool.max_overflow)
+
+
+def check_settings(settings: Settings, options: ServeOptions) -> Optional[str]:
+    # Кэш в памяти процесса не видит инвалидаций других воркеров и отдавал бы устаревшие данные
+    if options.workers > 1 and settings.cache.backend == "memory":
+        return "cache.backend=memory is per-process and goes stale with several workers, use redis or none"
+    # Иначе при нагрузке часть воркеров получит "too many clients" вместо ожидания в пуле
+    connections = options.workers * connections_per_worker(settings)
+    if connections > settings.postgres.max_connections:
+        return (
+            f"{options.workers} workers may open {connections} database connections, "
+            f"more than postgres.max_connections={settings.postgres.max_connections}; "
+            f"lower --workers or postgres.pool.size and max_overflow"
+        )
+    return None
+
+
+class Server(uvicorn.Server):
+    async def shutdown(self, sockets=None) -> None:
+        # uvicorn ждёт закрытия соединений раньше, чем вызывает lifespan shutdown,
+        # поэтому долгие потоки закрываем здесь, иначе остановка упрётся в таймаут
+        from src.application import begin_shutdown
+
+        begin_shutdown()
+        await super().shutdown(sockets)
+
+
+class Supervisor:
+    # Приложение импортируется до fork, поэтому модули и код общие для всех воркеров (copy-on-write).
+    # Движок базы создаётся в lifespan уже внутри воркера, соединения между процессами не делятся
+    def __init__(self, options: ServeOptions):
+        self.options = options
+        # pid -> (номер воркера, время запуска)
+        self.workers: Dict[int, Tuple[int, float]] = {}
+        self.stopping = False
+        self.socket: Optional[socket.socket] = None
+        self.app: Any = None
+
+    def run(self) -> None:
+        from src.application import app
+
+        self.app = app
+        config = uvicorn.Config(APP, host=self.options.host, port=self.options.port)
+        self.socket = config.bind_socket()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        logger.info("Starting %d workers on %s:%d", self.options.workers, self.options.host, self.options.port)
+        for index in range(self.options.workers):
+            self._spawn(index)
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is None or self.stopping:
+                continue
+            # Воркер вышел сам (отработал лимит запросов или упал) — заменяем его
+            index, started = worker
+            logger.info("Worker %d exited with status %d, restarting", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < RESPAWN_BACKOFF:
+                # Не перезапускаем в цикле воркер, который падает сразу при старте
+                time.sleep(RESPAWN_BACKOFF)
+            self._spawn(index)
+        self.socket.close()
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = (index, time.monotonic())
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            self._serve()
+        except BaseException:
+            logger.exception("Worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _serve(self) -> None:
+        limit = None
+        if self.options.max_requests:
+            # Разброс, чтобы воркеры не перезапускались одновременно
+            limit = self.options.max_requests + random.randint(0, self.options.max_requests_jitter)
+        config = uvicorn.Config(
+            self.app,
+            loop="auto",
+            http="auto",
+            log_config=self.options.log_config,
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=get_settings(Settings).shutdown_drain_timeout,
+        )
+        Server(config).run(sockets=[self.socket])
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.serve", description="Запуск API")
+    parser.add_argument("--profile", choices=("prod", "dev"), help="dev — один процесс с --reload")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="По умолчанию — по числу доступных ядер")
+    parser.add_argument("--max-requests", type=int, help="Перезапускать воркер после стольких запросов, 0 — никогда")
+    return parser
+
+
+def main(argv=None) -> None:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    settings = get_settings(Settings)
+    options = resolve_options(settings.serve, args)
+    fit_pool(settings, options)
+    error = check_settings(settings, options)
+    if error:
+        parser.error(error)
+    if options.reload:
+        uvicorn.run(APP, host=options.host, port=options.port, log_config=options.log_config, reload=True)
+        return
+    if not hasattr(os, "fork"):
+        uvicorn.run(APP, host=options.host, port=options.port, workers=options.workers, log_config=options.log_config)
+        return
+    if options.log_config:
+        logging.config.fileConfig(options.log_config, disable_existing_loggers=False)
+    Supervisor(options).run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
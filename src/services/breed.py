@@ -1,10 +1,103 @@
+import asyncio
+import hashlib
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from pydantic import TypeAdapter
+
+from src.database import primary_pinned
+from src.encoding import JSON, JSON_MEDIA_TYPE, Codec
 from src.repositories.breed import BreedRepository
-from src.schemas.breed import BreedView
+from src.schemas.breed import BreedStats, BreedView
+from src.singleflight import SingleFlight
+
+# entity-tag из RFC 9110: необязательный префикс слабого тега W/ и строка в кавычках,
+# внутри которой может быть запятая, поэтому список не делится по запятым
+ENTITY_TAG = re.compile(r'(?:W/)?"([^"]*)"')
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    body: bytes
+    etag: str
+    expires_at: float
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        # Для If-None-Match сравнение слабое: W/"x" совпадает с "x", сравниваются только значения
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return ENTITY_TAG.fullmatch(self.etag)[1] in ENTITY_TAG.findall(if_none_match)
+
+
+class BreedCache:
+    # Каталог хранится отдельно для каждого формата ответа, у каждого свой ETag
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self.lock = asyncio.Lock()
+        self._entries: Dict[str, CachedBody] = {}
+
+    def get(self, media_type: str = JSON_MEDIA_TYPE) -> Optional[CachedBody]:
+        entry = self._entries.get(media_type)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry
+
+    def set(self, body: bytes, media_type: str = JSON_MEDIA_TYPE) -> CachedBody:
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self._entries[media_type] = CachedBody(body=body, etag=etag, expires_at=time.monotonic() + self.ttl)
+        return self._entries[media_type]
+
+    def invalidate(self) -> None:
+        self._entries = {}
 
 
 class BreedService:
-    def __init__(self, repository: BreedRepository):
+    list_adapter = TypeAdapter(List[BreedView])
+
+    def __init__(
+        self,
+        repository: BreedRepository,
+        cache: Optional[BreedCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+    ):
         self.repository = repository
+        self.cache = cache or BreedCache()
+        self.single_flight = single_flight
+
+    async def _read_breeds(self):
+        if self.single_flight is None:
+            return await self.repository.get_all_breeds()
+        repository = self.repository.detached()
+        return await self.single_flight.do(("breeds", "get_all_breeds", primary_pinned()), repository.get_all_breeds)
 
     async def list_breeds(self) -> BreedView:
-        return await self.repository.get_all_breeds()
+        return await self._read_breeds()
+
+    async def get_breeds_catalogue(self, codec: Codec = JSON) -> CachedBody:
+        entry = self.cache.get(codec.media_type)
+        if entry is not None:
+            return entry
+        async with self.cache.lock:
+            # Пока ждали блокировку, каталог мог загрузить другой запрос
+            entry = self.cache.get(codec.media_type)
+            if entry is not None:
+                return entry
+            items = await self._read_breeds()
+            views = self.list_adapter.validate_python(items, from_attributes=True)
+            return self.cache.set(codec.dump(self.list_adapter, views), codec.media_type)
+
+    async def get_breed_stats(self) -> List[BreedStats]:
+        if self.single_flight is None:
+            return await self.repository.get_breed_stats()
+        repository = self.repository.detached()
+        return await self.single_flight.do(("breeds", "get_breed_stats", primary_pinned()), repository.get_breed_stats)
+
+    async def rebuild_breed_stats(self) -> None:
+        await self.repository.rebuild_breed_stats()
+
+    def invalidate_cache(self) -> None:
+        self.cache.invalidate()
@@ -1,48 +1,322 @@
-from typing import List
+import base64
+import binascii
+import json
+from typing import AsyncIterator, FrozenSet, List, Optional, Sequence, Tuple
 
 from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy import Row
 
+from src.batching import MicroBatcher
+from src.cache import EntityCache
+from src.changes import CREATED, DELETED, UPDATED, Change, ChangeFeed
+from src.database import UnitOfWork, primary_pinned
+from src.encoding import JSON, Codec
 from src.repositories.kitten import KittenRepository
-from src.schemas.kitten import KittenView, KittenCreate, KittenUpdate, KittenPatch
+from src.singleflight import SingleFlight
+from src.schemas.kitten import (
+    KittenView, KittenCreate, KittenUpdate, KittenPatch, KittenPage, KittenBulkResult, KittenBulkPatch,
+    KittenBulkOutcome, KittenRow, KittenFilter, KITTEN_FIELDS, parse_kitten_fields, kitten_view_subset, kitten_subset_adapter,
+)
+
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# Типы значений курсора по ключам сортировки: чужой тип в keyset-условии — это 500 от базы, а не 400
+CURSOR_TYPES = {"id": (int,), "age": (int,), "color": (str,), "rank": (int, float)}
+
+
+def cursor_values(names: Sequence[str], values) -> tuple:
+    if not isinstance(values, list) or len(values) != len(names):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for name, value in zip(names, values):
+        if isinstance(value, bool) or not isinstance(value, CURSOR_TYPES[name]):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(values)
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
+
+
+kitten_row_adapter = TypeAdapter(KittenRow)
+kitten_rows_adapter = TypeAdapter(List[KittenRow])
+
+
+def row_to_wire(row: Row) -> KittenRow:
+    return {
+        "color": row.color,
+        "age": row.age,
+        "description": row.description,
+        "breedId": row.breed_id,
+        "id": row.id,
+        "breed": {"name": row.breed_name, "id": row.breed_id},
+    }
+
+
+def row_to_subset(row: Row, fields: FrozenSet[str]) -> dict:
+    item = {name: getattr(row, name) for name in KITTEN_FIELDS if name in fields}
+    breed = {}
+    if "breed.id" in fields:
+        breed["id"] = row.breed_id
+    if "breed.name" in fields:
+        breed["name"] = row.breed_name
+    if breed:
+        item["breed"] = breed
+    return item
+
+
+def parse_fields(fields: Optional[str]) -> Optional[FrozenSet[str]]:
+    if fields is None:
+        return None
+    try:
+        return parse_kitten_fields(fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 class KittenService:
-    def __init__(self, repository: KittenRepository):
+    def __init__(
+        self,
+        repository: KittenRepository,
+        cache: Optional[EntityCache] = None,
+        unit_of_work: Optional[UnitOfWork] = None,
+        single_flight: Optional[SingleFlight] = None,
+        batcher: Optional[MicroBatcher[KittenCreate, Optional[dict]]] = None,
+        changes: Optional[ChangeFeed] = None,
+    ):
         self.repository = repository
         self.view_model = KittenView
+        self.cache = cache
+        self.unit_of_work = unit_of_work
+        self.single_flight = single_flight
+        self.batcher = batcher
+        self.changes = changes
+
+    async def _read(self, method: str, *args):
+        # После записи в этом запросе читаем своей сессией: общее чтение не увидит незакоммиченное
+        if self.single_flight is None or (self.unit_of_work is not None and self.unit_of_work.writing):
+            return await getattr(self.repository, method)(*args)
+        # Общий результат не должен зависеть от сессии запроса, который начал чтение.
+        # Чтение идёт в контексте первого запроса, поэтому закреплённые за основной базой
+        # не делят результат с читающими реплику
+        repository = self.repository.detached()
+        key = ("kittens", method, args, primary_pinned())
+        return await self.single_flight.do(key, lambda: getattr(repository, method)(*args))
+
+    def cache_stats(self) -> dict:
+        return self.cache.snapshot() if self.cache is not None else {}
 
-    async def list_kittens(self, bread_id: int = None) -> List[KittenView]:
-        items = await self.repository.get_all_kittens(bread_id)
-        return [self.view_model.model_validate(item, from_attributes=True) for item in items]
+    def batching_stats(self) -> dict:
+        return self.batcher.snapshot() if self.batcher is not None else {}
+
+    def coalescing_stats(self) -> dict:
+        return self.single_flight.snapshot() if self.single_flight is not None else {}
+
+    async def _invalidate(self, *kitten_ids: int) -> None:
+        if self.cache is None or not kitten_ids:
+            return
+        if self.unit_of_work is None:
+            await self.cache.invalidate(*kitten_ids)
+            return
+        # Сбрасываем и сразу, и после коммита: между ними конкурентное чтение
+        # может успеть положить в кэш ещё не изменённую строку
+        await self.cache.invalidate(*kitten_ids)
+        self.unit_of_work.after_commit(lambda: self.cache.invalidate(*kitten_ids))
+
+    async def _publish(self, changes: List[Change]) -> None:
+        if self.changes is None or not changes:
+            return
+        if self.unit_of_work is None:
+            await self.changes.publish(changes)
+            return
+        # Подписчики узнают только о закоммиченных изменениях
+        self.unit_of_work.after_commit(lambda: self.changes.publish(changes))
+
+    @staticmethod
+    def _change(change_type: str, view: KittenView) -> Change:
+        return change_type, view.id, view.model_dump(mode="json", by_alias=True)
+
+    async def list_kittens(
+        self, filters: Optional[KittenFilter] = None, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> KittenPage:
+        filters = filters or KittenFilter()
+        # Запрашиваем на одну запись больше, чтобы понять, есть ли следующая страница
+        fetch = limit + 1 if limit is not None else None
+        items = await self._read("get_all_kittens", filters, fetch, self._after(cursor, filters))
+        items, next_cursor = self._split_page(items, limit, filters)
+        return KittenPage(
+            items=[self.view_model.model_validate(item, from_attributes=True) for item in items],
+            next_cursor=next_cursor,
+        )
+
+    async def list_kittens_body(
+        self,
+        filters: Optional[KittenFilter] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        codec: Codec = JSON,
+    ) -> Tuple[bytes, Optional[str]]:
+        filters = filters or KittenFilter()
+        selected = parse_fields(fields)
+        fetch = limit + 1 if limit is not None else None
+        rows = await self._read("get_kitten_rows", filters, fetch, self._after(cursor, filters), selected)
+        rows, next_cursor = self._split_page(rows, limit, filters)
+        if selected is None:
+            return codec.dump(kitten_rows_adapter, [row_to_wire(row) for row in rows]), next_cursor
+        adapter = kitten_subset_adapter(selected)
+        items = adapter.validate_python([row_to_subset(row, selected) for row in rows])
+        return codec.dump(adapter, items, by_alias=True), next_cursor
+
+    async def search_kittens_body(
+        self,
+        query: str,
+        bread_id: Optional[int] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        codec: Codec = JSON,
+    ) -> Tuple[bytes, Optional[str]]:
+        after = None
+        if cursor:
+            payload = decode_cursor(cursor)
+            if payload.get("s") != "rank":
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            after = cursor_values(("rank", "id"), payload.get("k"))
+        rows = await self._read("search_kittens", query, bread_id, limit + 1, after)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor({"s": "rank", "k": [rows[-1].rank, rows[-1].id]})
+        return codec.dump(kitten_rows_adapter, [row_to_wire(row) for row in rows]), next_cursor
+
+    async def get_kitten_body(self, kitten_id: int, fields: Optional[str] = None, codec: Codec = JSON) -> bytes:
+        selected = parse_fields(fields)
+        if selected is not None:
+            row = await self._read("get_kitten_row", kitten_id, selected)
+            if row is None:
+                raise HTTPException(status_code=404, detail="Kitten not found")
+            return codec.dump_model(kitten_view_subset(selected).model_validate(row_to_subset(row, selected)))
+        if self.cache is not None:
+            # В кэше лежит готовое тело в запрошенном формате
+            cached = await self.cache.get(kitten_id, codec.media_type)
+            if cached is not None:
+                return cached
+        row = await self._read("get_kitten_row", kitten_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Kitten not found")
+        body = codec.dump(kitten_row_adapter, row_to_wire(row))
+        if self.cache is not None:
+            await self.cache.set(kitten_id, body, codec.media_type)
+        return body
+
+    @staticmethod
+    def _after(cursor: Optional[str], filters: KittenFilter) -> Optional[tuple]:
+        if not cursor:
+            return None
+        payload = decode_cursor(cursor)
+        # Курсор действителен только для той сортировки, с которой он был выдан
+        if payload.get("s") != ",".join(filters.sort):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return cursor_values([name for name, _ in filters.sort_columns], payload.get("k"))
+
+    @staticmethod
+    def _split_page(items: Sequence, limit: Optional[int], filters: KittenFilter) -> Tuple[Sequence, Optional[str]]:
+        if limit is None or len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        last = items[-1]
+        return items, encode_cursor({
+            "s": ",".join(filters.sort),
+            "k": [getattr(last, name) for name, _ in filters.sort_columns],
+        })
+
+    async def export_kittens(self, filters: Optional[KittenFilter] = None) -> AsyncIterator[bytes]:
+        async for rows in self.repository.stream_kittens(filters):
+            yield b"".join(kitten_row_adapter.dump_json(row_to_wire(row)) + b"\n" for row in rows)
 
     async def get_kitten_by_id(self, kitten_id: int) -> KittenView:
-        item = await self.repository.get_kitten_by_id(kitten_id)
+        if self.cache is not None:
+            return self.view_model.model_validate_json(await self.get_kitten_body(kitten_id))
+        item = await self._read("get_kitten_by_id", kitten_id)
         if item is None:
             raise HTTPException(status_code=404, detail="Kitten not found")
         return self.view_model.model_validate(item, from_attributes=True)
 
     async def create_kitten(self, kitten: KittenCreate) -> KittenView:
+        if self.batcher is not None:
+            # Запись уходит пачкой со своей транзакцией: она уже закоммичена, а событие
+            # опубликовано, когда мы получаем результат
+            result = await self.batcher.submit(kitten)
+            if result.kitten is None:
+                raise HTTPException(status_code=400, detail=result.error)
+            return result.kitten
         item = await self.repository.add_kitten(kitten)
-        return self.view_model.model_validate(item, from_attributes=True)
+        view = self.view_model.model_validate(item, from_attributes=True)
+        await self._invalidate(view.id)
+        await self._publish([self._change(CREATED, view)])
+        return view
+
+    async def create_kittens(self, kittens: List[KittenCreate]) -> List[KittenBulkResult]:
+        rows = await self.repository.add_kittens(kittens)
+        results = [
+            KittenBulkResult(index=index, kitten=self.view_model.model_validate(row))
+            if row is not None
+            else KittenBulkResult(index=index, error=f"Breed {kitten.breed_id} not found")
+            for index, (kitten, row) in enumerate(zip(kittens, rows))
+        ]
+        await self._publish([self._change(CREATED, result.kitten) for result in results if result.kitten is not None])
+        return results
 
     async def update_kitten(self, kitten_id: int, kitten_data: KittenUpdate) -> KittenView:
         item = await self.repository.update_kitten(kitten_id, kitten_data)
         if item is None:
             raise HTTPException(status_code=404, detail="Kitten not found")
-        return self.view_model.model_validate(item, from_attributes=True)
+        await self._invalidate(kitten_id)
+        view = self.view_model.model_validate(item, from_attributes=True)
+        await self._publish([self._change(UPDATED, view)])
+        return view
 
     async def patch_kitten(self, kitten_id: int, kitten_data: KittenPatch) -> KittenView:
         item = await self.repository.patch_kitten(kitten_id, kitten_data)
         if item is None:
             raise HTTPException(status_code=404, detail="Kitten not found")
-        return self.view_model.model_validate(item, from_attributes=True)
+        await self._invalidate(kitten_id)
+        view = self.view_model.model_validate(item, from_attributes=True)
+        await self._publish([self._change(UPDATED, view)])
+        return view
 
     async def delete_kitten(self, kitten_id: int) -> bool:
         deleted = await self.repository.delete_kitten(kitten_id)
         if not deleted:
             raise HTTPException(status_code=404, detail="Kitten not found")
+        await self._invalidate(kitten_id)
+        await self._publish([(DELETED, kitten_id, None)])
         return True
 
+    async def patch_kittens(self, patches: List[KittenBulkPatch]) -> KittenBulkOutcome:
+        updated, missing = await self.repository.patch_kittens(patches)
+        await self._invalidate(*updated)
+        # Массовое изменение возвращает только id: подписчики получают событие без данных
+        await self._publish([(UPDATED, kitten_id, None) for kitten_id in updated])
+        return KittenBulkOutcome(ids=updated, missing=missing)
+
+    async def delete_kittens(self, kitten_ids: List[int]) -> KittenBulkOutcome:
+        deleted, missing = await self.repository.delete_kittens(kitten_ids)
+        await self._invalidate(*deleted)
+        await self._publish([(DELETED, kitten_id, None) for kitten_id in deleted])
+        return KittenBulkOutcome(ids=deleted, missing=missing)
+
     #
     # async def update_kitten(self, kitten_id: int, **kwargs):
     #     kitten = await self.repository.get_kitten_by_id(kitten_id)
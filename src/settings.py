@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import TypeVar
+from typing import Dict, List, Literal, TypeVar
 
 from dotenv import load_dotenv
 from pydantic import PostgresDsn, BaseModel, model_validator
@@ -8,6 +8,17 @@ load_dotenv()
 TSettings = TypeVar("TSettings", bound=BaseSettings)
 
 
+class PoolSettings(BaseModel):
+    size: int = 10
+    max_overflow: int = 10
+    timeout: float = 30.0
+    recycle: int = 1800
+    pre_ping: bool = True
+    statement_timeout_ms: int | None = 30000
+    # Сколько соединений открыть при старте, до того как приложение начнёт принимать запросы
+    prewarm: int = 5
+
+
 class PostgresSettings(BaseModel):
     scheme: str
     user: str
@@ -16,6 +27,12 @@ class PostgresSettings(BaseModel):
     port: str
     db: str
     url: PostgresDsn | None = None
+    replica_urls: List[PostgresDsn] = []
+    replica_strategy: Literal["round_robin", "least_connections"] = "round_robin"
+    pool: PoolSettings = PoolSettings()
+    # max_connections сервера с запасом для миграций и консоли; все воркеры вместе в него укладываются
+    max_connections: int = 90
+    echo: bool = False
 
     @model_validator(mode="after")
     def set_postgres_dsn(self):
@@ -31,6 +48,92 @@ class PostgresSettings(BaseModel):
         return self
 
 
+class CacheSettings(BaseModel):
+    # По умолчанию выключен: memory годится только для одного процесса, redis требует адреса
+    backend: Literal["memory", "redis", "none"] = "none"
+    redis_url: str | None = None
+    redis_pool_size: int = 4
+    redis_timeout: float = 0.25
+    ttl: float = 60.0
+    # После записи ключ не заполняется столько секунд — больше отставания реплик
+    invalidation_hold: float = 5.0
+    max_size: int = 10000
+
+
+class WriteBatchSettings(BaseModel):
+    # Склейка конкурентных POST /kittens/ в один INSERT; выключено по умолчанию
+    enabled: bool = False
+    max_items: int = 100
+    max_delay_ms: float = 5.0
+
+
+class ChangeFeedSettings(BaseModel):
+    replay_size: int = 1000
+    buffer_size: int = 256
+    keepalive: float = 15.0
+    retry_ms: int = 2000
+    # В PostgreSQL события между воркерами передаются через LISTEN/NOTIFY
+    bridge: bool = True
+    channel: str = "kitten_changes"
+    # Сколько ждать событие с пропущенным номером, прежде чем выдать следующие
+    reorder_window: float = 0.5
+
+
+class QueryLogSettings(BaseModel):
+    # Пороги на один запрос к API; strict превращает превышение в исключение (для тестов)
+    enabled: bool = True
+    slow_query_ms: float = 100.0
+    request_sql_ms: float = 500.0
+    max_statements: int = 50
+    repeated_statements: int = 10
+    strict: bool = False
+
+
+class CompressionLevel(BaseModel):
+    gzip: int = 6
+    brotli: int = 4
+
+
+class CompressionSettings(BaseModel):
+    enabled: bool = True
+    minimum_size: int = 1024
+    default: CompressionLevel = CompressionLevel()
+    # Уровни по шаблону пути: потоковую выгрузку сжимаем быстрее, а не сильнее
+    routes: Dict[str, CompressionLevel] = {"/kittens/export": CompressionLevel(gzip=1, brotli=1)}
+
+
+class AdmissionLimit(BaseModel):
+    initial: int
+    min: int
+    max: int
+    # Сколько запросов может ждать в очереди сверх лимита и сколько секунд
+    queue_size: int = 64
+    queue_timeout: float = 0.5
+
+
+class AdmissionSettings(BaseModel):
+    enabled: bool = True
+    read: AdmissionLimit = AdmissionLimit(initial=40, min=4, max=200)
+    write: AdmissionLimit = AdmissionLimit(initial=10, min=2, max=50, queue_size=16)
+    # Ожидание соединения из пула дольше этого считается перегрузкой базы
+    pool_wait_target_ms: float = 20.0
+    decrease_factor: float = 0.7
+    retry_after: int = 1
+    # Лента изменений — долгие соединения, они не должны занимать места в лимите
+    exempt_paths: List[str] = ["/health", "/metrics", "/kittens/changes"]
+
+
+class ServeSettings(BaseModel):
+    profile: Literal["prod", "dev"] = "prod"
+    host: str = "0.0.0.0"
+    port: int = 8003
+    # По умолчанию по числу доступных процессу ядер
+    workers: int | None = None
+    max_requests: int = 10000
+    max_requests_jitter: int = 1000
+    log_config: str | None = "logging.ini"
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file_encoding="utf-8",
@@ -38,6 +141,16 @@ class Settings(BaseSettings):
         env_nested_delimiter="__",
     )
     postgres: PostgresSettings
+    breed_cache_ttl: float = 300.0
+    cache: CacheSettings = CacheSettings()
+    fast_read_path: bool = True
+    query_log: QueryLogSettings = QueryLogSettings()
+    shutdown_drain_timeout: float = 30.0
+    compression: CompressionSettings = CompressionSettings()
+    serve: ServeSettings = ServeSettings()
+    admission: AdmissionSettings = AdmissionSettings()
+    write_batching: WriteBatchSettings = WriteBatchSettings()
+    changes: ChangeFeedSettings = ChangeFeedSettings()
 
 
 @lru_cache
@@ -0,0 +1,56 @@
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    # Одинаковые конкурентные чтения ждут один общий запрос к базе.
+    # Запрос выполняется в отдельной задаче: отмена одного из ожидающих его не прерывает,
+    # задача отменяется только когда не осталось ни одного ожидающего
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(partial(self._forget, key, call))
+            self.executed += 1
+        else:
+            self.collapsed += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Отменённая задача завершается не сразу (закрытие сессии и т.п.): убираем её заранее,
+                # чтобы пришедший в этот момент вызов начал новый запрос, а не получил чужую отмену
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call, task: asyncio.Task) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not task.cancelled():
+            # Помечаем исключение как полученное, даже если все ожидающие были отменены
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"executed": self.executed, "collapsed": self.collapsed, "in_flight": self.in_flight}
@@ -1,18 +1,46 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import sys
+
 import pytest
 import pytest_asyncio
+from fastapi import Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
 from httpx import AsyncClient
+from pydantic import ValidationError
+from sqlalchemy import create_engine, event, select, text
+from starlette.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from contextlib import asynccontextmanager
 
-from src.application import app
-from src.database import Database
-from src.factory import service_factory
-from src.models import Base, Breed, Kitten
+from src.admission import AdaptiveLimiter, AdmissionMiddleware
+from src.application import app, lifespan
+from src.batching import MicroBatcher
+from src.bulk import BulkError, BulkImporter, Checkpoint, export_table, read_records
+from src.cache import EntityCache, MemoryCache, RedisCache, RedisClient
+from src.changes import ChangeEvent, ChangeFeed, PostgresBridge
+from src.database import Database, UnitOfWork, _primary_pinned as primary_pin
+from src.encoding import packb
+from src.lifecycle import Lifecycle, lifecycle
+from src.factory import get_unit_of_work, service_factory
+from src.metrics import DB_POOL_CHECKOUT_DURATION, instrument_engine, measure_pool_wait
+from src.query_log import QueryAudit, QueryBudgetExceeded, QueryLog, attach as attach_query_log
+from src.models import Base, Breed, BreedAgeStat, Kitten
+from src.schemas.kitten import SORT_INDEXES, KittenCreate, KittenFilter, KittenPatch
+from src.serve import build_parser, check_settings, connections_per_worker, fit_pool, resolve_options
+from src.settings import (
+    AdmissionLimit, AdmissionSettings, CacheSettings, PoolSettings, QueryLogSettings, ServeSettings, Settings,
+    get_settings,
+)
 from src.repositories.breed import BreedRepository
 from src.repositories.kitten import KittenRepository
-from src.services.breed import BreedService
-from src.services.kitten import KittenService
+from src.services.breed import BreedService, BreedCache
+from src.services.kitten import KittenService, encode_cursor
+from src.singleflight import SingleFlight
 
 class TestDatabase:
     def __init__(self, db_url: str = "sqlite+aiosqlite:///:memory:"):
@@ -73,20 +101,48 @@ async def kitten(test_db, breed):
         yield new_breed
 
 
+@pytest.fixture(scope="function")
+def breed_cache():
+    return BreedCache(ttl=60)
+
+
+@pytest.fixture(scope="function")
+def kitten_cache():
+    return EntityCache(MemoryCache(), "kitten", ttl=60)
+
+
+@pytest.fixture(scope="function")
+def change_feed():
+    return ChangeFeed(replay_size=10, buffer_size=5)
+
+
+@pytest.fixture(scope="function")
+def query_log(test_db):
+    # Строгий режим: медленный или болтливый запрос к API валит тест
+    attach_query_log(test_db._engine)
+    return QueryLog(QueryLogSettings(strict=True))
+
+
 @pytest_asyncio.fixture(scope="function")
-async def async_client(test_db):
-    async def override_create_kitten_service():
-        repository = KittenRepository(test_db.session)
-        return KittenService(repository)
+async def async_client(test_db, breed_cache, kitten_cache, query_log, change_feed):
+    async def override_get_unit_of_work():
+        async with UnitOfWork(test_db._session_factory, query_log=query_log) as uow:
+            yield uow
 
-    async def override_create_breed_service():
-        repository = BreedRepository(test_db.session)
-        return BreedService(repository)
+    async def override_create_kitten_service(uow: UnitOfWork = Depends(get_unit_of_work)):
+        repository = KittenRepository(uow.session, uow.read_session, uow.detached_session)
+        return KittenService(repository, cache=kitten_cache, unit_of_work=uow, changes=change_feed)
 
+    async def override_create_breed_service(uow: UnitOfWork = Depends(get_unit_of_work)):
+        repository = BreedRepository(uow.session, uow.read_session)
+        return BreedService(repository, breed_cache)
+
+    app.dependency_overrides[get_unit_of_work] = override_get_unit_of_work
     app.dependency_overrides[service_factory.create_kitten_service] = override_create_kitten_service
     app.dependency_overrides[service_factory.create_breed_service] = override_create_breed_service
     app.dependency_overrides[Database.session] = lambda: test_db.session()
     app.dependency_overrides[Database] = lambda: test_db
+    app.dependency_overrides[service_factory.get_change_feed] = lambda: change_feed
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
@@ -157,3 +213,1068 @@ async def test_list_breeds(async_client, breed):
     data = response.json()
     assert len(data) == 1
     assert data[0]["id"] == breed.id
+
+
+@pytest.mark.asyncio
+async def test_list_kittens_cursor_pagination(async_client, test_db, breed):
+    async with test_db.session() as session:
+        session.add_all([
+            Kitten(description=f"Kitten {i}", color="grey", age=i, breed_id=breed.id) for i in range(5)
+        ])
+        await session.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get("/kittens/", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) <= 2
+        seen.extend(item["id"] for item in data)
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+
+
+@pytest.mark.asyncio
+async def test_list_kittens_invalid_cursor(async_client):
+    response = await async_client.get("/kittens/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    # Подделанные значения ключей не доходят до базы
+    for params, payload in (
+        ({}, {"s": "id", "k": [{"a": 1}]}),
+        ({}, {"s": "id", "k": ["1"]}),
+        ({"sort": "color"}, {"s": "color,id", "k": [1, 2]}),
+        ({"sort": "-age"}, {"s": "-age,-id", "k": [True, 1]}),
+    ):
+        response = await async_client.get("/kittens/", params={**params, "cursor": encode_cursor(payload)})
+        assert response.status_code == 400
+    response = await async_client.get("/kittens/search", params={"q": "fluffy", "cursor": encode_cursor({"s": "rank", "k": ["x", 1]})})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_export_kittens_ndjson(async_client, kitten):
+    response = await async_client.get("/kittens/export", params={"breed_id": kitten.breed_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    exported = json.loads(lines[0])
+    listed = (await async_client.get(f"/kittens/{kitten.id}")).json()
+    assert exported == listed
+
+
+@pytest.mark.asyncio
+async def test_list_breeds_etag(async_client, test_db, breed, breed_cache):
+    response = await async_client.get("/breeds/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = await async_client.get("/breeds/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    # Список тегов и слабые теги: If-None-Match сравнивает их без учёта W/
+    for header in (f'"other", W/{etag}', f'W/"a,b", {etag}', "*"):
+        assert (await async_client.get("/breeds/", headers={"If-None-Match": header})).status_code == 304
+    for header in ('"other"', f"W/{etag[:-2]}\"", etag.strip('"')):
+        assert (await async_client.get("/breeds/", headers={"If-None-Match": header})).status_code == 200
+
+    # Каталог отдаётся из кэша до явной инвалидации
+    async with test_db.session() as session:
+        session.add(Breed(name="Persian"))
+        await session.commit()
+    response = await async_client.get("/breeds/")
+    assert len(response.json()) == 1
+
+    breed_cache.invalidate()
+    response = await async_client.get("/breeds/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_create_kittens_bulk(async_client, test_db, breed):
+    payload = [
+        {"description": "First", "color": "black", "age": 1, "breed_id": breed.id},
+        {"description": "Lost", "color": "white", "age": 2, "breed_id": breed.id + 100},
+        {"description": "Second", "color": "red", "age": 3, "breedId": breed.id},
+    ]
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_db._engine.sync_engine, "before_cursor_execute", count)
+    try:
+        response = await async_client.post("/kittens/bulk", json=payload)
+    finally:
+        event.remove(test_db._engine.sync_engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    # Проверка пород и один многострочный INSERT, без вставки по строке
+    assert len([statement for statement in statements if statement.startswith("INSERT")]) == 1
+    assert len(statements) == 2
+    data = response.json()
+    assert [item["index"] for item in data] == [0, 1, 2]
+    assert data[0]["kitten"]["description"] == "First"
+    assert data[0]["kitten"]["breed"]["name"] == breed.name
+    assert data[1]["kitten"] is None
+    assert "not found" in data[1]["error"]
+    assert data[2]["kitten"]["id"] > data[0]["kitten"]["id"]
+
+    response = await async_client.get("/kittens/")
+    assert [item["description"] for item in response.json()] == ["First", "Second"]
+
+
+@pytest.mark.asyncio
+async def test_patch_kittens_bulk(async_client, kitten):
+    payload = [
+        {"id": kitten.id, "age": 5},
+        {"id": kitten.id + 100, "color": "white"},
+    ]
+    response = await async_client.patch("/kittens/bulk", json=payload)
+    assert response.status_code == 200
+    assert response.json() == {"ids": [kitten.id], "missing": [kitten.id + 100]}
+
+    data = (await async_client.get(f"/kittens/{kitten.id}")).json()
+    assert data["age"] == 5
+    assert data["color"] == kitten.color
+
+
+@pytest.mark.asyncio
+async def test_delete_kittens_bulk(async_client, kitten):
+    response = await async_client.delete("/kittens/", params={"ids": [kitten.id, kitten.id + 100]})
+    assert response.status_code == 200
+    assert response.json() == {"ids": [kitten.id], "missing": [kitten.id + 100]}
+    response = await async_client.get(f"/kittens/{kitten.id}")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_read_replica_routing(tmp_path):
+    urls = {}
+    for name in ("primary", "replica"):
+        path = tmp_path / f"{name}.db"
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(Breed.__table__.insert(), {"name": name})
+        engine.dispose()
+        urls[name] = f"sqlite+aiosqlite:///{path}"
+
+    database = Database(urls["primary"], replica_urls=[urls["replica"]])
+    repository = BreedRepository(database.session, database.read_session)
+    assert [breed.name for breed in await repository.get_all_breeds()] == ["replica"]
+
+    # После обращения к основной базе чтения в том же контексте идут в неё же
+    async with database.session():
+        pass
+    assert [breed.name for breed in await repository.get_all_breeds()] == ["primary"]
+
+
+@pytest.mark.asyncio
+async def test_patch_kitten_returns_new_breed(async_client, test_db, kitten):
+    async with test_db.session() as session:
+        persian = Breed(name="Persian")
+        session.add(persian)
+        await session.commit()
+        await session.refresh(persian)
+
+    response = await async_client.patch(f"/kittens/{kitten.id}", json={"breedId": persian.id})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["breed"] == {"name": "Persian", "id": persian.id}
+    assert data["description"] == kitten.description
+
+    response = await async_client.patch(f"/kittens/{kitten.id + 100}", json={"age": 3})
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_fast_read_path_matches_orm_serialization(test_db, breed):
+    async with test_db.session() as session:
+        session.add(Kitten(description="Пушистый \"котёнок\"", color="рыжий", age=2, breed_id=breed.id))
+        await session.commit()
+    service = KittenService(KittenRepository(test_db.session))
+
+    page = await service.list_kittens(limit=10)
+    body, next_cursor = await service.list_kittens_body(limit=10)
+    assert body == JSONResponse(jsonable_encoder(page.items)).body
+    assert next_cursor == page.next_cursor
+
+    kitten_id = page.items[0].id
+    view = await service.get_kitten_by_id(kitten_id)
+    assert await service.get_kitten_body(kitten_id) == JSONResponse(jsonable_encoder(view)).body
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_shares_one_transaction(test_db, breed):
+    kitten_data = KittenCreate(description="Fluffy", color="black", age=1, breed_id=breed.id)
+    with pytest.raises(RuntimeError):
+        async with UnitOfWork(test_db._session_factory) as uow:
+            repository = KittenRepository(uow.session, uow.read_session)
+            kitten = await repository.add_kitten(kitten_data)
+            # Чтение в том же запросе видит незакоммиченную запись
+            assert (await repository.get_kitten_by_id(kitten.id)) is not None
+            raise RuntimeError("abort")
+
+    async with UnitOfWork(test_db._session_factory) as uow:
+        repository = KittenRepository(uow.session, uow.read_session)
+        assert await repository.get_all_kittens() == []
+
+
+@pytest.mark.asyncio
+async def test_get_kitten_reads_through_cache(async_client, kitten, kitten_cache):
+    response = await async_client.get(f"/kittens/{kitten.id}")
+    assert response.status_code == 200
+    response = await async_client.get(f"/kittens/{kitten.id}")
+    assert response.status_code == 200
+    stats = (await async_client.get("/kittens/cache/stats")).json()
+    assert stats == {"hits": 1, "misses": 1, "errors": 0}
+
+    # Запись сбрасывает закэшированную версию
+    response = await async_client.patch(f"/kittens/{kitten.id}", json={"age": 7})
+    assert response.status_code == 200
+    response = await async_client.get(f"/kittens/{kitten.id}")
+    assert response.json()["age"] == 7
+
+
+class FakeRedisClient:
+    def __init__(self):
+        self.data = {}
+
+    async def execute(self, *args):
+        command, *params = args
+        if command == "GET":
+            return self.data.get(params[0])
+        if command == "SET":
+            if "NX" in params and params[0] in self.data:
+                return None
+            self.data[params[0]] = params[1]
+            return b"OK"
+        if command == "DEL":
+            return sum(self.data.pop(key, None) is not None for key in params)
+        raise AssertionError(f"Unexpected command {command}")
+
+    async def pipeline(self, commands):
+        return [await self.execute(*args) for args in commands]
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_with_redis_backend():
+    client = FakeRedisClient()
+    cache = EntityCache(RedisCache(client), "kitten", ttl=1.5)
+    assert await cache.get(1) is None
+    await cache.set(1, b"{}")
+    assert client.data == {"kitten:1:application/json": b"{}"}
+    assert await cache.get(1) == b"{}"
+    await cache.invalidate(1)
+    assert await cache.get(1) is None
+    assert cache.snapshot() == {"hits": 1, "misses": 2, "errors": 0}
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_is_not_repopulated_right_after_invalidation():
+    cache = EntityCache(MemoryCache(), "kitten", ttl=60, invalidation_hold=0.05)
+    await cache.invalidate(1)
+    # Чтение с отстающей реплики не должно вернуть в кэш старую версию
+    await cache.set(1, b'{"age": 1}')
+    assert await cache.get(1) is None
+    await asyncio.sleep(0.06)
+    await cache.set(1, b'{"age": 7}')
+    assert await cache.get(1) == b'{"age": 7}'
+
+
+@pytest.mark.asyncio
+async def test_redis_client_times_out_and_drops_connection():
+    async def handle(reader, writer):
+        # Сервер принимает команду и молчит
+        await reader.read(100)
+        await asyncio.sleep(1)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = RedisClient(f"redis://127.0.0.1:{port}/0", pool_size=2, timeout=0.05)
+    cache = EntityCache(RedisCache(client), "kitten")
+    try:
+        assert await cache.get(1) is None
+        assert cache.snapshot()["errors"] == 1
+        assert client._idle == []
+    finally:
+        server.close()
+
+
+def test_serve_rejects_memory_cache_with_several_workers():
+    settings = Settings(cache=CacheSettings(backend="memory"))
+    options = resolve_options(settings.serve, build_parser().parse_args(["--workers", "4"]))
+    assert check_settings(settings, options) is not None
+    options = resolve_options(settings.serve, build_parser().parse_args(["--workers", "1"]))
+    assert check_settings(settings, options) is None
+
+
+def test_serve_fits_database_pool_into_max_connections(monkeypatch):
+    # fit_pool пишет размер пула в окружение для воркеров, в тестах — в копию
+    monkeypatch.setattr(os, "environ", {**os.environ})
+    options = resolve_options(ServeSettings(), build_parser().parse_args(["--workers", "8"]))
+    # Явно заданный пул не трогаем, а проверяем: 8 × (10 + 10 + 1) не помещается в 90
+    settings = Settings()
+    settings.postgres.pool = PoolSettings(size=10, max_overflow=10)
+    fit_pool(settings, options)
+    assert settings.postgres.pool.size == 10
+    assert "max_connections=90" in check_settings(settings, options)
+
+    settings = Settings()
+    fit_pool(settings, options)
+    pool = settings.postgres.pool
+    assert (pool.size, pool.max_overflow) == (5, 5)
+    assert os.environ["POSTGRES__POOL__SIZE"] == "5"
+    assert check_settings(settings, options) is None
+    assert 8 * connections_per_worker(settings) <= settings.postgres.max_connections
+
+
+@pytest.mark.asyncio
+async def test_single_flight_collapses_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    waiters = [asyncio.create_task(single_flight.do("key", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    # Отмена одного ожидающего не прерывает общий запрос для остальных
+    waiters[0].cancel()
+    release.set()
+    results = await asyncio.gather(*waiters[1:])
+    assert results == [1, 1, 1, 1]
+    assert waiters[0].cancelled()
+    assert single_flight.snapshot() == {"executed": 1, "collapsed": 4, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_restarts_after_last_waiter_cancelled():
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def load():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        finally:
+            # Очистка после отмены занимает несколько итераций цикла
+            for _ in range(3):
+                await asyncio.sleep(0)
+        return "stale"
+
+    first = asyncio.create_task(single_flight.do("key", load))
+    await started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    assert first.cancelled()
+
+    async def fresh():
+        return "fresh"
+
+    assert await single_flight.do("key", fresh) == "fresh"
+    assert single_flight.snapshot() == {"executed": 2, "collapsed": 0, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        single_flight.do("key", fail), single_flight.do("key", fail), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.in_flight == 0
+    # После ошибки следующий вызов выполняется заново
+    with pytest.raises(ValueError):
+        await single_flight.do("key", fail)
+    assert single_flight.executed == 2
+
+
+@pytest.mark.asyncio
+async def test_list_kittens_coalesced(test_db, kitten):
+    single_flight = SingleFlight()
+    service = KittenService(KittenRepository(test_db.session), single_flight=single_flight)
+    results = await asyncio.gather(*(service.list_kittens_body(limit=10) for _ in range(3)))
+    assert len({body for body, _ in results}) == 1
+    assert (single_flight.executed, single_flight.collapsed) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_coalescing_respects_writes_and_primary_pin(test_db, kitten):
+    single_flight = SingleFlight()
+    async with UnitOfWork(test_db._session_factory) as uow:
+        repository = KittenRepository(uow.session, uow.read_session, uow.detached_session)
+        service = KittenService(repository, unit_of_work=uow, single_flight=single_flight)
+        await service.patch_kitten(kitten.id, KittenPatch(age=9))
+        # Запрос с записью читает своей сессией и видит незакоммиченное изменение
+        assert json.loads(await service.get_kitten_body(kitten.id))["age"] == 9
+    assert single_flight.executed == 0
+
+    service = KittenService(KittenRepository(test_db.session), single_flight=single_flight)
+
+    async def read(pinned: bool) -> bytes:
+        primary_pin.set(pinned)
+        return await service.get_kitten_body(kitten.id)
+
+    # Закреплённое за основной базой чтение не делит результат с чтением реплики
+    await asyncio.gather(read(False), read(True), read(False))
+    assert (single_flight.executed, single_flight.collapsed) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_sparse_fieldsets(async_client, kitten, breed):
+    response = await async_client.get("/kittens/", params={"fields": "id,color,breed.name"})
+    assert response.status_code == 200
+    assert response.json() == [{"color": kitten.color, "id": kitten.id, "breed": {"name": breed.name}}]
+
+    response = await async_client.get(f"/kittens/{kitten.id}", params={"fields": "age,breedId"})
+    assert response.json() == {"age": kitten.age, "breedId": breed.id}
+
+    response = await async_client.get("/kittens/", params={"fields": "id,weight"})
+    assert response.status_code == 400
+
+
+def test_sparse_fieldsets_select_only_requested_columns():
+    repository = KittenRepository(None)
+    sql = str(repository._fields_stmt(frozenset({"color", "breed.id"})))
+    assert "breeds" not in sql
+    assert "description" not in sql
+    assert "breeds" in str(repository._fields_stmt(frozenset({"breed.name"})))
+
+
+@pytest.mark.asyncio
+async def test_list_kittens_filters_and_sort(async_client, test_db, breed):
+    async with test_db.session() as session:
+        session.add_all([
+            Kitten(description=f"Kitten {i}", color=("black", "white")[i % 2], age=i % 4, breed_id=breed.id)
+            for i in range(12)
+        ])
+        await session.commit()
+
+    params = {"age_min": 1, "age_max": 3, "color": ["black"], "sort": "-age", "limit": 2}
+    seen = []
+    while True:
+        response = await async_client.get("/kittens/", params=params)
+        assert response.status_code == 200
+        seen.extend((item["age"], item["id"]) for item in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params["cursor"] = cursor
+    assert len(seen) == 3
+    assert seen == sorted(seen, reverse=True)
+    assert all(age == 2 for age, _ in seen)
+
+    # Разные направления: курсор продолжает с того же места
+    params = {"age_min": 1, "sort": "age,-id", "limit": 4}
+    seen = []
+    while True:
+        response = await async_client.get("/kittens/", params=params)
+        assert response.status_code == 200
+        seen.extend((item["age"], -item["id"]) for item in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        params["cursor"] = cursor
+    assert len(seen) == 9
+    assert seen == sorted(seen)
+
+    for params in (
+        {"age_min": 1},
+        {"color": ["black", "white"]},
+        {"breed_id": [breed.id, breed.id + 1], "color": ["black", "white"], "sort": "age"},
+        {"breed_id": breed.id, "sort": "color"},
+        {"sort": "-age,id"},
+    ):
+        response = await async_client.get("/kittens/", params=params)
+        assert response.status_code == 200, params
+    for params in ({"sort": "weight"}, {"sort": "age,-age"}, {"sort": "age,color"}):
+        response = await async_client.get("/kittens/", params=params)
+        assert response.status_code == 400, params
+
+
+def test_sort_indexes_match_models():
+    indexes = {tuple(column.name for column in index.columns) for index in Kitten.__table__.indexes}
+    assert set(SORT_INDEXES) - {("id",)} <= indexes
+
+
+@pytest.mark.asyncio
+async def test_list_kittens_filters_use_indexes(test_db):
+    repository = KittenRepository(test_db.session)
+    sorts = (
+        "id", "-id", "age", "-age", "color", "-color", "color,age", "-color,-age", "age,color", "-age,id", "age,-id",
+        "color,-age",
+    )
+    rejected = []
+    async with test_db.session() as session:
+        for breed_ids, ages, colors, sort in itertools.product(
+            ((), (1,), (1, 2)), ((None, None), (1, None), (1, 3)), ((), ("black",), ("black", "white")), sorts
+        ):
+            try:
+                filters = KittenFilter(breed_ids=breed_ids, age_min=ages[0], age_max=ages[1], colors=colors, sort=sort)
+            except ValidationError:
+                rejected.append((breed_ids, ages, colors, sort))
+                continue
+            filtered = breed_ids or ages[0] is not None or colors
+            # Без фильтров проверяем порядок на выборке без join: с join планировщик SQLite без статистики
+            # не досортировывает хвост по частичному порядку индекса, PostgreSQL делает это (incremental sort)
+            stmt = repository.row_stmt if filtered else repository._fields_stmt(frozenset({"id"}), filters)
+            for after in (None, tuple(1 for _ in filters.sort)):
+                compiled = repository._page(stmt, filters, 10, after).compile(
+                    dialect=session.bind.dialect, compile_kwargs={"literal_binds": True}
+                )
+                plan = (await session.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))).all()
+                detail = " ".join(row[-1] for row in plan)
+                if filtered:
+                    # Индекс сужает выборку, либо строки идут в порядке индекса или ключа и LIMIT обрывает чтение
+                    assert "SEARCH kittens USING INDEX" in detail or "TEMP B-TREE FOR ORDER BY" not in detail, (
+                        filters, detail
+                    )
+                else:
+                    # Индекс задаёт порядок по первому ключу, досортировываются только остальные
+                    assert "TEMP B-TREE FOR ORDER BY" not in detail, (filters, detail)
+    # Отклоняется только сортировка, которую без фильтра не отдаёт ни один индекс
+    assert rejected == [((), (None, None), (), "age,color")]
+
+
+@pytest.mark.asyncio
+async def test_search_kittens(async_client, test_db, breed):
+    async with test_db.session() as session:
+        session.add_all([
+            Kitten(description="Very playful and active", color="white", age=5, breed_id=breed.id),
+            Kitten(description="Calm and quiet", color="black", age=7, breed_id=breed.id),
+            Kitten(description="Playful, playful and curious", color="pink", age=3, breed_id=breed.id),
+        ])
+        await session.commit()
+
+    response = await async_client.get("/kittens/search", params={"q": "playful", "limit": 1})
+    assert response.status_code == 200
+    first = response.json()
+    assert [item["description"] for item in first] == ["Playful, playful and curious"]
+
+    response = await async_client.get(
+        "/kittens/search", params={"q": "playful", "limit": 1, "cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert [item["description"] for item in response.json()] == ["Very playful and active"]
+    assert "X-Next-Cursor" not in response.headers
+
+    # Изменение описания сразу отражается в индексе
+    kitten_id = first[0]["id"]
+    await async_client.patch(f"/kittens/{kitten_id}", json={"description": "Sleepy"})
+    response = await async_client.get("/kittens/search", params={"q": "\"sleepy*"})
+    assert [item["id"] for item in response.json()] == [kitten_id]
+    response = await async_client.get("/kittens/search", params={"q": "quiet", "breed_id": breed.id + 1})
+    assert response.json() == []
+
+
+@pytest.mark.asyncio
+async def test_breed_stats(async_client, test_db, breed):
+    async with test_db.session() as session:
+        persian = Breed(name="Persian")
+        session.add(persian)
+        await session.commit()
+        await session.refresh(persian)
+
+    payload = [
+        {"description": "First", "color": "black", "age": 1, "breed_id": breed.id},
+        {"description": "Second", "color": "white", "age": 4, "breed_id": breed.id},
+        {"description": "Third", "color": "black", "age": 7, "breed_id": breed.id},
+    ]
+    ids = [item["kitten"]["id"] for item in (await async_client.post("/kittens/bulk", json=payload)).json()]
+    created = (await async_client.post(
+        "/kittens/", json={"description": "Fourth", "color": "red", "age": 2, "breed_id": breed.id}
+    )).json()
+    await async_client.patch(f"/kittens/{ids[0]}", json={"breedId": persian.id})
+    await async_client.patch("/kittens/bulk", json=[{"id": ids[1], "age": 9}])
+    await async_client.delete(f"/kittens/{created['id']}")
+
+    response = await async_client.get("/breeds/stats")
+    assert response.status_code == 200
+    expected = [
+        {"id": breed.id, "name": "Siamese", "count": 2, "min_age": 7, "avg_age": 8.0, "max_age": 9,
+         "colors": {"black": 1, "white": 1}},
+        {"id": persian.id, "name": "Persian", "count": 1, "min_age": 1, "avg_age": 1.0, "max_age": 1,
+         "colors": {"black": 1}},
+    ]
+    assert response.json() == expected
+
+    # Пересборка восстанавливает испорченную сводку
+    async with test_db.session() as session:
+        await session.execute(BreedAgeStat.__table__.update().values(count=100))
+        await session.commit()
+    async with UnitOfWork(test_db._session_factory) as uow:
+        await BreedRepository(uow.session).rebuild_breed_stats()
+    assert (await async_client.get("/breeds/stats")).json() == expected
+
+
+@pytest.mark.asyncio
+async def test_metrics(async_client, test_db, kitten):
+    instrument_engine(test_db._engine, "test")
+    assert (await async_client.get(f"/kittens/{kitten.id}")).status_code == 200
+    assert (await async_client.get("/kittens/0")).status_code == 404
+
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert any(
+        line.startswith('http_request_duration_seconds_count{method="GET",route="/kittens/{kitten_id}",status="200"}')
+        for line in lines
+    )
+    assert any('route="/kittens/{kitten_id}",status="404"' in line for line in lines)
+    assert any(
+        line.startswith('db_query_duration_seconds_count{engine="test",route="/kittens/{kitten_id}",statement="SELECT"}')
+        for line in lines
+    )
+    assert any(line.startswith('db_pool_checkout_duration_seconds_count{engine="test"}') for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics_survive_dispose(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pool.db")
+    instrument_engine(engine, "disposed")
+    instrument_engine(engine, "disposed")
+    checkouts = lambda: DB_POOL_CHECKOUT_DURATION._series[("disposed",)][2]
+    try:
+        async with engine.connect():
+            pass
+        assert checkouts() == 1
+        # dispose() пересоздаёт пул, замер выдачи остаётся на новом
+        await engine.dispose()
+        with measure_pool_wait() as waited:
+            async with engine.connect():
+                pass
+        assert checkouts() == 2
+        assert waited[0] > 0
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_query_log_detects_repeated_statements(test_db, breed):
+    attach_query_log(test_db._engine)
+    query_log = QueryLog(QueryLogSettings(strict=True, repeated_statements=3))
+    with pytest.raises(QueryBudgetExceeded) as error:
+        async with UnitOfWork(test_db._session_factory, query_log=query_log) as uow:
+            async with uow.session() as session:
+                # Классический N+1: одно и то же выражение с разными параметрами
+                for kitten_id in range(3):
+                    await session.execute(select(Kitten).where(Kitten.id == kitten_id))
+    record = error.value.record
+    assert record["violations"] == ["repeated_statement"]
+    assert record["statements"] == 3
+    assert record["repeated"][0]["distinct_params"] == 3
+    assert record["slowest"][0]["params"] == ["int"]
+
+    # Значения параметров не хранятся даже для поиска повторов
+    audit = QueryAudit()
+    audit.record("SELECT 1", ("secret", [1, 2]), False, 0.0)
+    audit.record("INSERT", [("secret",)] * 3, True, 0.0)
+    assert all(isinstance(variant, int) for variants in audit.variants.values() for variant in variants)
+
+    # Тот же запрос с одинаковыми параметрами N+1 не считается
+    async with UnitOfWork(test_db._session_factory, query_log=query_log) as uow:
+        async with uow.session() as session:
+            for _ in range(3):
+                await session.execute(select(Kitten).where(Kitten.id == 1))
+
+
+@pytest.mark.asyncio
+async def test_lifespan_prewarms_and_drains(tmp_path, monkeypatch):
+    db = Database(f"sqlite+aiosqlite:///{tmp_path}/lifespan.db", echo=False)
+    async with db.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(Breed.__table__.insert().values(name="Siamese"))
+    service_factory.use_database(db)
+    prewarmed = []
+    monkeypatch.setattr(db, "prewarm", lambda connections: asyncio.sleep(0, prewarmed.append(connections)))
+    monkeypatch.setattr(service_factory._settings.postgres, "pool", PoolSettings(size=2, max_overflow=10, prewarm=5))
+    try:
+        async with lifespan(app):
+            assert lifecycle.ready
+            # Прогреваются только постоянные соединения пула
+            assert prewarmed == [2]
+            # Каталог пород загружен до первого запроса
+            assert json.loads(service_factory._breed_cache.get().body)[0]["name"] == "Siamese"
+            async with AsyncClient(app=app, base_url="http://test") as client:
+                assert (await client.get("/health/ready")).json() == {"status": "ok"}
+        assert service_factory._db is None
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json() == {"status": "draining"}
+    finally:
+        service_factory._breed_cache.invalidate()
+        lifecycle.ready = lifecycle.draining = False
+        await db.dispose()
+
+
+@pytest.mark.asyncio
+async def test_lifecycle_drain_waits_for_in_flight_requests():
+    state = Lifecycle()
+    state.request_started()
+    drain = asyncio.ensure_future(state.drain(timeout=1))
+    await asyncio.sleep(0.01)
+    assert not drain.done()
+    state.request_finished()
+    assert await drain is True
+
+    state.request_started()
+    assert await state.drain(timeout=0.01) is False
+
+
+@pytest.mark.asyncio
+async def test_compression_and_msgpack(async_client, test_db, breed, kitten_cache):
+    async with test_db.session() as session:
+        session.add_all([
+            Kitten(description=f"Kitten number {index}", color="black", age=index, breed_id=breed.id)
+            for index in range(30)
+        ])
+        await session.commit()
+
+    response = await async_client.get("/kittens/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 30
+    # Маленькие ответы не сжимаются
+    response = await async_client.get("/kittens/", params={"limit": 1}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    response = await async_client.get("/kittens/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 30
+
+    as_json = await async_client.get("/kittens/", params={"limit": 5})
+    as_msgpack = await async_client.get("/kittens/", params={"limit": 5}, headers={"Accept": "application/msgpack"})
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert as_msgpack.content == packb(as_json.json())
+
+    kitten_id = as_json.json()[0]["id"]
+    for _ in range(2):  # промах и попадание в кэш
+        single = await async_client.get(f"/kittens/{kitten_id}", headers={"Accept": "application/msgpack"})
+        assert single.content == packb(as_json.json()[0])
+    # Каждый формат кэшируется отдельно, готовым телом
+    assert await kitten_cache.get(kitten_id, "application/msgpack") == single.content
+    assert await kitten_cache.get(kitten_id) is None
+    patched = await async_client.patch(
+        f"/kittens/{kitten_id}", json={"age": 99}, headers={"Accept": "application/msgpack"}
+    )
+    assert patched.content == packb({**as_json.json()[0], "age": 99})
+
+    breeds = await async_client.get("/breeds/", headers={"Accept": "application/msgpack"})
+    assert breeds.content == packb([{"name": breed.name, "id": breed.id}])
+    assert breeds.headers["etag"] != (await async_client.get("/breeds/")).headers["etag"]
+
+
+@pytest.mark.asyncio
+async def test_compressed_responses_get_weak_etag(async_client, breed, breed_cache, monkeypatch):
+    monkeypatch.setattr(get_settings(Settings).compression, "minimum_size", 0)
+    identity = await async_client.get("/breeds/", headers={"Accept-Encoding": "identity"})
+    etag = identity.headers["etag"]
+    assert not etag.startswith("W/")
+    compressed = await async_client.get("/breeds/", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["etag"] == f"W/{etag}"
+    # Сжатый и исходный варианты подтверждаются любым из тегов
+    for header in (etag, f"W/{etag}"):
+        for accept_encoding in ("gzip", "identity"):
+            response = await async_client.get(
+                "/breeds/", headers={"If-None-Match": header, "Accept-Encoding": accept_encoding}
+            )
+            assert response.status_code == 304
+            assert response.headers["etag"] == (f"W/{etag}" if accept_encoding == "gzip" else etag)
+
+
+def test_serve_profiles():
+    settings = ServeSettings(workers=4, max_requests=100)
+    prod = resolve_options(settings, build_parser().parse_args([]))
+    assert (prod.workers, prod.max_requests, prod.reload) == (4, 100, False)
+    dev = resolve_options(settings, build_parser().parse_args(["--profile", "dev", "--max-requests", "0"]))
+    assert (dev.workers, dev.max_requests, dev.reload) == (1, 0, True)
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_queues_and_sheds():
+    limiter = AdaptiveLimiter(AdmissionLimit(initial=2, min=1, max=4, queue_size=1, queue_timeout=0.05), 0.01, 0.5)
+    assert await limiter.acquire() and await limiter.acquire()
+    queued = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    assert not await limiter.acquire()  # очередь полна
+    limiter.release(0.0, 0.0)
+    assert await queued
+    assert limiter.in_flight == 2 and limiter.limit > 2
+
+    # Долгое ожидание пула снижает лимит, но только один раз на волну запросов
+    limiter.release(0.0, 0.5)
+    assert limiter.limit == pytest.approx(1.0, abs=0.3)
+    limiter.release(0.0, 0.5)
+    assert limiter.limit >= 1 and limiter.in_flight == 0
+    assert await limiter.acquire()
+    assert not await limiter.acquire()  # ждал дольше queue_timeout
+    assert limiter.rejected == 2
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_handoff_races(monkeypatch):
+    limiter = AdaptiveLimiter(AdmissionLimit(initial=2, min=1, max=4, queue_size=2, queue_timeout=1), 0.01, 0.5)
+    assert await limiter.acquire() and await limiter.acquire()
+
+    # Отменённый ожидающий, которому уже передали место, возвращает его без роста лимита
+    queued = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release(0.0, 0.0)
+    limit = limiter.limit
+    queued.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert limiter.in_flight == 1 and limiter.limit == limit
+
+    # Место передано одновременно с истечением ожидания: запрос допущен, а не потерян
+    assert await limiter.acquire()
+
+    @asynccontextmanager
+    async def handed_off_then_timed_out(delay):
+        limiter.release(0.0, 0.0)
+        yield
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(asyncio, "timeout", handed_off_then_timed_out)
+    assert await limiter.acquire()
+    assert limiter.in_flight == 2 and limiter.queued == 0 and limiter.rejected == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_middleware_sheds_with_retry_after():
+    settings = AdmissionSettings(read=AdmissionLimit(initial=1, min=1, max=1, queue_size=0))
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await JSONResponse({})(scope, receive, send)
+
+    shedding = AdmissionMiddleware(slow_app, settings)
+    async with AsyncClient(app=shedding, base_url="http://test") as client:
+        first = asyncio.create_task(client.get("/kittens/"))
+        await asyncio.sleep(0.01)
+        rejected = await client.get("/kittens/")
+        assert rejected.status_code == 503
+        assert rejected.headers["retry-after"] == "1"
+        # Служебные эндпоинты не ограничиваются
+        health = asyncio.create_task(client.get("/health/live"))
+        await asyncio.sleep(0.01)
+        release.set()
+        assert (await first).status_code == 200
+        assert (await health).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_bulk_export_and_resumable_import(test_db, tmp_path):
+    async with test_db.session() as session:
+        session.add_all([Breed(name="Persian"), Breed(name="Sphynx")])
+        await session.flush()
+        breeds = (await session.execute(select(Breed))).scalars().all()
+        session.add_all([
+            Kitten(description=f"Kitten, \"{index}\"", color="black", age=index, breed_id=breeds[index % 2].id)
+            for index in range(25)
+        ])
+        await session.commit()
+    breeds_path, kittens_path = tmp_path / "breeds.csv", tmp_path / "kittens.ndjson"
+    with open(breeds_path, "w", newline="") as out:
+        assert await export_table(test_db._engine, "breeds", out, "csv", batch_size=1) == 2
+    with open(kittens_path, "w") as out:
+        assert await export_table(test_db._engine, "kittens", out, "ndjson", batch_size=10) == 25
+
+    target = Database(f"sqlite+aiosqlite:///{tmp_path / 'target.db'}", echo=False)
+    async with target.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await BulkImporter(target.engine, "breeds").run(read_records(str(breeds_path), "csv"))
+
+    # Прерванная загрузка: первая пачка уже в базе и отмечена в файле прогресса
+    progress = str(tmp_path / "kittens.progress")
+    await BulkImporter(target.engine, "kittens").run(list(read_records(str(kittens_path), "ndjson"))[:10])
+    Checkpoint(progress, str(kittens_path), chunk_size=10).mark(0, 10)
+
+    resumed = Checkpoint(progress, str(kittens_path), chunk_size=10)
+    assert resumed.done == {0}
+    importer = BulkImporter(target.engine, "kittens", chunk_size=10, defer_indexes=True, checkpoint=resumed)
+    assert await importer.run(read_records(str(kittens_path), "ndjson")) == 15
+
+    with open(tmp_path / "copy.ndjson", "w") as out:
+        await export_table(target.engine, "kittens", out, "ndjson")
+    assert (tmp_path / "copy.ndjson").read_text() == kittens_path.read_text()
+    async with target.engine.connect() as conn:
+        indexes = (await conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))).scalars().all()
+    assert "ix_kittens_breed_id_age_id" in indexes
+
+    with pytest.raises(BulkError, match="line 1: unknown breed"):
+        await BulkImporter(target.engine, "kittens").run([(1, {"breed": "Maine Coon", "color": "red", "age": 1, "description": "x"})])
+    await target.dispose()
+
+    # Тот же размер, но файл перезаписан: чужой прогресс не применяется
+    Checkpoint(progress, str(kittens_path), chunk_size=10).mark(0, 10)
+    stat = os.stat(kittens_path)
+    os.utime(kittens_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    with pytest.raises(BulkError, match="belongs to another file"):
+        Checkpoint(progress, str(kittens_path), chunk_size=10)
+    with pytest.raises(BulkError, match="stdin"):
+        Checkpoint(progress, "-", chunk_size=10)
+
+
+def test_read_records_from_stdin(monkeypatch):
+    stdin = io.TextIOWrapper(io.BytesIO('{"name": "Сиамская"}\n\n{"name": "Мейн-кун"}\n'.encode()))
+    monkeypatch.setattr(sys, "stdin", stdin)
+    assert list(read_records("-", "ndjson")) == [(1, {"name": "Сиамская"}), (3, {"name": "Мейн-кун"})]
+    assert not stdin.buffer.closed
+
+
+@pytest.mark.asyncio
+async def test_micro_batched_creates(test_db, breed, change_feed):
+    subscription, _ = change_feed.subscribe()
+
+    async def insert_kittens(kittens):
+        # Как ServiceFactory._insert_kittens: своя единица работы и публикация после её коммита
+        async with UnitOfWork(test_db._session_factory) as uow:
+            batch_service = KittenService(KittenRepository(uow.session), unit_of_work=uow, changes=change_feed)
+            return await batch_service.create_kittens(kittens)
+
+    batcher = MicroBatcher(insert_kittens, max_items=4, max_delay=0.05)
+    service = KittenService(KittenRepository(test_db.session), batcher=batcher, changes=change_feed)
+    kittens = [
+        KittenCreate(description=f"Kitten {index}", color="black", age=index, breed_id=breed.id if index != 2 else 999)
+        for index in range(6)
+    ]
+    results = await asyncio.gather(*(service.create_kitten(kitten) for kitten in kittens), return_exceptions=True)
+    # Четыре записи ушли пачкой по размеру, оставшиеся две — по таймеру
+    assert batcher.snapshot() == {"batches": 2, "items": 6, "pending": 0}
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 400
+    created = [result for result in results if not isinstance(result, Exception)]
+    assert [view.age for view in created] == [0, 1, 3, 4, 5]
+    assert all(view.breed.name == "Siamese" for view in created)
+    # Каждое событие опубликовано один раз, из транзакции пачки
+    events = await subscription.next(1)
+    assert sorted(event.kitten_id for event in events) == sorted(view.id for view in created)
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_fails_waiters_when_write_is_interrupted():
+    async def flush(items):
+        raise asyncio.CancelledError
+
+    batcher = MicroBatcher(flush, max_items=2, max_delay=1)
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.submit(item) for item in (1, 2)), return_exceptions=True), 1
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_isolates_failing_item():
+    calls = []
+
+    async def flush(items):
+        calls.append(list(items))
+        if any(item < 0 for item in items):
+            raise ValueError("negative")
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(flush, max_items=3, max_delay=1)
+    results = await asyncio.gather(*(batcher.submit(item) for item in (1, -1, 2)), return_exceptions=True)
+    assert results[0] == 10 and results[2] == 20
+    assert isinstance(results[1], ValueError)
+    assert calls == [[1, -1, 2], [1], [-1], [2]]
+
+
+@pytest.mark.asyncio
+async def test_change_feed_replay_and_slow_consumers():
+    feed = ChangeFeed(replay_size=3, buffer_size=2)
+    fast, replay = feed.subscribe()
+    slow, _ = feed.subscribe()
+    assert replay == []
+    for kitten_id in range(1, 6):
+        await feed.publish([("created", kitten_id, None)])
+        assert [event.kitten_id for event in await fast.next(1)] == [kitten_id]
+    # Медленный подписчик переполнил буфер и отключён, быстрый получил всё
+    assert await slow.next(1) is None
+    assert feed.snapshot() == {"subscribers": 1, "published": 5, "dropped": 1, "last_event_id": 5}
+    assert await fast.next(0.01) == []
+
+    _, replay = feed.subscribe(last_event_id=3)
+    assert [event.id for event in replay] == [4, 5]
+    # Событие 2 уже вытеснено из журнала: клиент должен перечитать состояние
+    _, replay = feed.subscribe(last_event_id=1)
+    assert replay == [ChangeEvent(5, "reset", 0, {})]
+
+
+@pytest.mark.asyncio
+async def test_postgres_bridge_reorders_notifications():
+    feed = ChangeFeed(replay_size=10, buffer_size=10)
+    subscription, _ = feed.subscribe()
+    bridge = PostgresBridge(feed, None, "kitten_changes", reorder_window=0.05)
+
+    def notify(event_id: int) -> None:
+        payload = json.dumps({"type": "created", "id": event_id, "data": None})
+        bridge._on_notify(None, 0, "kitten_changes", f"{event_id}:{payload}")
+
+    # Транзакции закоммитились не в порядке номеров из последовательности
+    for event_id in (1, 3, 2):
+        notify(event_id)
+    assert [event.id for event in await subscription.next(1)] == [1, 2, 3]
+
+    # Номер 4 так и не пришёл: после окна выдаём следующие
+    notify(5)
+    assert await subscription.next(0.01) == []
+    assert [event.id for event in await subscription.next(1)] == [5]
+
+    # Опоздавшее дольше окна событие получают подключённые, а продолжение с выданных id — reset
+    notify(4)
+    assert [event.id for event in await subscription.next(1)] == [4]
+    _, replay = feed.subscribe(last_event_id=3)
+    assert [event.type for event in replay] == ["reset"]
+    notify(6)
+    notify(7)
+    assert [event.id for event in await subscription.next(1)] == [6, 7]
+    _, replay = feed.subscribe(last_event_id=5)
+    assert [event.type for event in replay] == ["reset"]
+    _, replay = feed.subscribe(last_event_id=6)
+    assert [event.id for event in replay] == [7]
+    await bridge.stop()
+
+
+@pytest.mark.asyncio
+async def test_kitten_changes_stream(async_client, change_feed, breed):
+    created = await async_client.post("/kittens/", json={"description": "Fluffy", "color": "black", "age": 1, "breed_id": breed.id})
+    kitten_id = created.json()["id"]
+    await async_client.patch(f"/kittens/{kitten_id}", json={"age": 2})
+    await async_client.delete(f"/kittens/{kitten_id}")
+    await async_client.patch("/kittens/999", json={"age": 3})  # 404 — события нет
+
+    # Закрытая лента отдаёт журнал и завершает поток, как при остановке воркера
+    change_feed.close()
+    response = await async_client.get("/kittens/changes", headers={"Last-Event-ID": "1", "Accept-Encoding": "gzip"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "content-encoding" not in response.headers
+    frames = response.text.split("\n\n")
+    assert frames[0] == "retry: 2000"
+    assert frames[1].splitlines()[:2] == ["id: 2", "event: updated"]
+    assert json.loads(frames[1].splitlines()[2][len("data: "):])["age"] == 2
+    assert frames[2] == f'id: 3\nevent: deleted\ndata: {{"id": {kitten_id}}}'
+    assert (await async_client.get("/kittens/changes", headers={"Last-Event-ID": "x"})).status_code == 400